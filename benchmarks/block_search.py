@@ -0,0 +1,124 @@
+import os
+import tempfile
+from datetime import date, timedelta
+
+import click
+
+from benchmarks.fake_chain import FakeBatchRpc, FakeWeb3, SyntheticChain
+from utils.eth_service import EthService
+from utils.find_deployment_block_for_contract import find_deployment_block_for_contract
+
+DEPLOYMENTS = {
+    "0x0000000000000000000000000000000000000001": 4650000,
+    "0x0000000000000000000000000000000000000002": 13975838,
+    "0x0000000000000000000000000000000000000003": 16900123,
+}
+
+
+def count_date_range_round_trips(dates, batch_size, cache_file=None, sweep=False):
+    chain = SyntheticChain()
+    rpc = FakeBatchRpc(chain) if batch_size > 1 else None
+    eth_service = EthService(
+        FakeWeb3(chain), rpc=rpc, batch_size=batch_size, cache_file=cache_file
+    )
+
+    if sweep:
+        results = eth_service.get_block_ranges_for_dates(dates)
+    else:
+        results = [eth_service.get_block_range_for_date(d) for d in dates]
+    return results, chain.round_trips
+
+
+def count_deployment_round_trips(batch_size):
+    chain = SyntheticChain(deployments=DEPLOYMENTS)
+    rpc = FakeBatchRpc(chain) if batch_size > 1 else None
+
+    results = [
+        find_deployment_block_for_contract(
+            contract_address, FakeWeb3(chain), rpc=rpc, batch_size=batch_size
+        )
+        for contract_address in DEPLOYMENTS
+    ]
+    return results, chain.round_trips
+
+
+@click.command(context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option(
+    "-b",
+    "--batch-size",
+    default=8,
+    show_default=True,
+    type=int,
+    help="The number of blocks probed per batched round trip.",
+)
+@click.option(
+    "-d",
+    "--num-days",
+    default=30,
+    show_default=True,
+    type=int,
+    help="The number of consecutive days to resolve block ranges for.",
+)
+def benchmark_block_search(batch_size, num_days):
+    dates = [date(2023, 2, 1) + timedelta(days=i) for i in range(num_days)]
+
+    sequential_ranges, sequential_round_trips = count_date_range_round_trips(dates, 1)
+    batched_ranges, batched_round_trips = count_date_range_round_trips(
+        dates, batch_size
+    )
+    assert sequential_ranges == batched_ranges
+
+    print(
+        "Block ranges for {} days: {} round trips sequential, {} batched ({:.1f}x fewer)".format(
+            num_days,
+            sequential_round_trips,
+            batched_round_trips,
+            sequential_round_trips / batched_round_trips,
+        )
+    )
+
+    # Resolve all day boundaries in one sweep, each search seeded from the previous one
+    for sweep_batch_size in (1, batch_size):
+        sweep_ranges, sweep_round_trips = count_date_range_round_trips(
+            dates, sweep_batch_size, sweep=True
+        )
+        assert sweep_ranges == sequential_ranges
+
+        print(
+            "Block ranges for {} days in one sweep (batch size {}): {} round trips".format(
+                num_days, sweep_batch_size, sweep_round_trips
+            )
+        )
+
+    # Resolve the same dates twice with a persistent block timestamp cache,
+    # as consecutive export runs would
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = os.path.join(tmp_dir, "block_timestamps.sqlite")
+        count_date_range_round_trips(dates, batch_size, cache_file)
+        cached_ranges, cached_round_trips = count_date_range_round_trips(
+            dates, batch_size, cache_file
+        )
+    assert cached_ranges == sequential_ranges
+
+    print(
+        "Block ranges for {} days with a warm block timestamp cache: {} round trips".format(
+            num_days, cached_round_trips
+        )
+    )
+
+    sequential_blocks, sequential_round_trips = count_deployment_round_trips(1)
+    batched_blocks, batched_round_trips = count_deployment_round_trips(batch_size)
+    assert sequential_blocks == batched_blocks == list(DEPLOYMENTS.values())
+
+    print(
+        "Deployment blocks for {} contracts: {} round trips sequential, {} batched ({:.1f}x fewer)".format(
+            len(DEPLOYMENTS),
+            sequential_round_trips,
+            batched_round_trips,
+            sequential_round_trips / batched_round_trips,
+        )
+    )
+
+
+if __name__ == "__main__":
+    benchmark_block_search()
@@ -0,0 +1,107 @@
+import hashlib
+
+# (first block, seconds per block) for each era of the synthetic chain
+BLOCK_TIME_ERAS = [(0, 15), (4370000, 14), (15537394, 12)]
+GENESIS_TIMESTAMP = 1438269973
+LATEST_BLOCK = 17400000
+
+
+def jitter(n, block_time):
+    # Deterministic per-block jitter smaller than the block time, so that timestamps
+    # stay strictly increasing while block times vary like on a real chain
+    digest = hashlib.blake2b(n.to_bytes(8, "big"), digest_size=4).digest()
+    return int.from_bytes(digest, "big") % block_time
+
+
+class SyntheticChain(object):
+    def __init__(self, latest_block=LATEST_BLOCK, deployments=None):
+        """Offline chain with block timestamps and contract deployments, counting round trips"""
+        self.latest_block = latest_block
+        self.deployments = deployments or {}
+        self.round_trips = 0
+
+        # Timestamp at the first block of each era
+        self._era_timestamps = []
+        timestamp = GENESIS_TIMESTAMP
+        for i, (first_block, block_time) in enumerate(BLOCK_TIME_ERAS):
+            if i > 0:
+                previous_first_block, previous_block_time = BLOCK_TIME_ERAS[i - 1]
+                timestamp += (first_block - previous_first_block) * previous_block_time
+            self._era_timestamps.append(timestamp)
+
+    def timestamp(self, n):
+        if n == 0:
+            return 0
+        for (first_block, block_time), era_timestamp in reversed(
+            list(zip(BLOCK_TIME_ERAS, self._era_timestamps))
+        ):
+            if n >= first_block:
+                return (
+                    era_timestamp
+                    + (n - first_block) * block_time
+                    + jitter(n, block_time)
+                )
+
+    def block_number(self, identifier):
+        if identifier == "latest":
+            return self.latest_block
+        if isinstance(identifier, str):
+            return int(identifier, 16)
+        return identifier
+
+    def has_code(self, contract_address, n):
+        return n >= self.deployments.get(contract_address, self.latest_block + 1)
+
+
+class FakeBlock(object):
+    def __init__(self, number, timestamp):
+        self.number = number
+        self.timestamp = timestamp
+
+
+class FakeEth(object):
+    def __init__(self, chain):
+        self._chain = chain
+
+    def get_block(self, block_identifier):
+        self._chain.round_trips += 1
+        n = self._chain.block_number(block_identifier)
+        return FakeBlock(n, self._chain.timestamp(n))
+
+    def get_code(self, contract_address, block_identifier):
+        self._chain.round_trips += 1
+        n = self._chain.block_number(block_identifier)
+        return b"\x60" if self._chain.has_code(contract_address, n) else b""
+
+
+class FakeWeb3(object):
+    def __init__(self, chain):
+        """Stands in for web3.Web3 with the subset of the eth module EthService uses"""
+        self.eth = FakeEth(chain)
+
+
+class FakeBatchRpc(object):
+    def __init__(self, chain):
+        """Stands in for JsonRpcBatchClient, answering each batch in one round trip"""
+        self._chain = chain
+
+    @property
+    def round_trips(self):
+        return self._chain.round_trips
+
+    def batch(self, calls):
+        self._chain.round_trips += 1
+        results = []
+        for method, params in calls:
+            n = self._chain.block_number(
+                params[0] if method != "eth_getCode" else params[1]
+            )
+            if method == "eth_getBlockByNumber":
+                results.append(
+                    {"number": hex(n), "timestamp": hex(self._chain.timestamp(n))}
+                )
+            elif method == "eth_getCode":
+                results.append("0x60" if self._chain.has_code(params[0], n) else "0x")
+            else:
+                raise ValueError("Unsupported method {}".format(method))
+        return results
@@ -0,0 +1,210 @@
+import copy
+import time
+
+import click
+import pandas as pd
+
+from core.generate_metadata_output import build_metadata_output
+
+METADATA_FILE = "metadata_0xED5AF388653567Af2F388E6224dC7C4b3241C544.csv"
+
+
+def melt_metadata_output(metadata_df):
+    # Reconstruct raw attributes (value, trait_type, asset_id) from a metadata output
+    # by melting its *_attribute columns, one category after another
+    attribute_columns = [c for c in metadata_df.columns if c.endswith("_attribute")]
+    raw_attributes = metadata_df.melt(
+        id_vars=["asset_id"], value_vars=attribute_columns, var_name="trait_type"
+    )
+    raw_attributes = raw_attributes[raw_attributes["value"].notnull()]
+    raw_attributes["trait_type"] = raw_attributes["trait_type"].str[
+        : -len("_attribute")
+    ]
+    return raw_attributes[["value", "trait_type", "asset_id"]].reset_index(drop=True)
+
+
+def legacy_generate_metadata_output(raw_attributes, num_tokens):
+    # The per-category merge loop generate_metadata_output used before the trait
+    # matrix, kept to compare timings and outputs
+    # Drop nulls
+    raw_attributes = raw_attributes[raw_attributes["trait_type"].notnull()]
+
+    # Determine the attribute count of each item and calculate rarity
+    attribute_count = (
+        raw_attributes.groupby("asset_id").size().reset_index(name="attribute_count")
+    )
+    attribute_count_rarity = (
+        attribute_count.groupby("attribute_count")
+        .size()
+        .reset_index(name="count_rarity")
+    )
+    attribute_count_rarity["attribute_count_rarity_score"] = 1 / (
+        attribute_count_rarity["count_rarity"] / (num_tokens)
+    )
+
+    # Determine the trait for each category and calculate rarity
+    trait_rarity = (
+        raw_attributes.groupby(["trait_type", "value"])
+        .size()
+        .reset_index(name="trait_rarity")
+    )
+    trait_rarity["trait_rarity_score"] = 1 / (
+        trait_rarity["trait_rarity"] / (num_tokens)
+    )
+
+    # Calculate the rarity of having (or not having) a trait within each category
+    category_rarity = (
+        trait_rarity[["trait_type", "value", "trait_rarity"]]
+        .groupby("trait_type")
+        .sum(numeric_only=True)
+        .reset_index()
+    )
+    category_rarity["category_none_score"] = 1 / (
+        ((num_tokens) - category_rarity["trait_rarity"]) / (num_tokens)
+    )
+
+    # Join and transpose trait data
+    categories = raw_attributes[["asset_id", "value", "trait_type"]]
+    categories = categories.merge(
+        trait_rarity[["trait_type", "value", "trait_rarity_score"]],
+        on=["trait_type", "value"],
+        how="left",
+    )
+    nft_df = copy.deepcopy(attribute_count)
+    nft_df = nft_df.merge(
+        attribute_count_rarity[["attribute_count", "attribute_count_rarity_score"]],
+        on="attribute_count",
+        how="left",
+    )
+
+    # Replace spaces and parenthesis in category names
+    categories["trait_type"] = categories["trait_type"].str.replace(
+        " ", "_", regex=True
+    )
+    categories["trait_type"] = categories["trait_type"].str.replace(
+        r"\(", "", regex=True
+    )
+    categories["trait_type"] = categories["trait_type"].str.replace(
+        r"\)", "", regex=True
+    )
+    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
+        " ", "_", regex=True
+    )
+    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
+        r"\(", "", regex=True
+    )
+    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
+        r"\)", "", regex=True
+    )
+
+    # Drop duplicate categories
+    distinct_trait_types = categories["trait_type"].unique()
+
+    # Generate new columns for each trait category
+    df_dict = {}
+    for name in distinct_trait_types:
+        df_dict[name] = pd.DataFrame()
+        df_dict[name] = categories[(categories["trait_type"] == name)]
+        df_dict[name].columns = [
+            "asset_id",
+            "value_" + name,
+            "trait_type_" + name,
+            "trait_rarity_score_" + name,
+        ]
+
+    for name in distinct_trait_types:
+        nft_df = nft_df.merge(df_dict[name], on="asset_id", how="left")
+
+    base_column_names = ["asset_id", "attribute_count", "attribute_count_rarity_score"]
+    trait_column_names = []
+
+    for name in distinct_trait_types:
+        trait_column_names.append(str(name) + "_attribute")
+        trait_column_names.append(str(name))
+        trait_column_names.append(str(name) + "_rarity_score")
+
+    column_names = base_column_names + trait_column_names
+    nft_df.columns = column_names
+
+    category_none_scores = category_rarity[["trait_type", "category_none_score"]]
+
+    for name in distinct_trait_types:
+        nft_df[str(name) + "_rarity_score"] = nft_df[
+            str(name) + "_rarity_score"
+        ].fillna(
+            value=category_none_scores.loc[
+                category_none_scores["trait_type"] == name, "category_none_score"
+            ].iloc[0]
+        )
+
+    # Calculate overall rarity score as the sum of the individual trait rarity scores
+    nft_df["overall_rarity_score"] = nft_df[
+        [col for col in nft_df.columns if col.endswith("_rarity_score")]
+    ].sum(axis=1)
+
+    # Clean up dataframe for output
+    for name in distinct_trait_types:
+        nft_df.drop(columns=[name], inplace=True)
+    nft_df = nft_df.drop_duplicates(subset=["asset_id"])
+
+    return nft_df
+
+
+def scale_collection(raw_attributes, scale):
+    # Repeat the collection with shifted token IDs to benchmark larger collections
+    max_asset_id = raw_attributes["asset_id"].max() + 1
+    copies = []
+    for i in range(scale):
+        copy_df = raw_attributes.copy()
+        copy_df["asset_id"] += i * max_asset_id
+        copies.append(copy_df)
+    return pd.concat(copies, ignore_index=True)
+
+
+@click.command(context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option(
+    "--metadata-file",
+    default=METADATA_FILE,
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="A metadata output to reconstruct the raw attributes from.",
+)
+@click.option(
+    "--scale",
+    default=1,
+    show_default=True,
+    type=int,
+    help="The number of copies of the collection to score together.",
+)
+def benchmark_rarity_engine(metadata_file, scale):
+    raw_attributes = scale_collection(
+        melt_metadata_output(pd.read_csv(metadata_file)), scale
+    )
+    num_tokens = raw_attributes["asset_id"].nunique()
+    print(
+        "Scoring {} tokens with {} attributes".format(num_tokens, len(raw_attributes))
+    )
+
+    # Only the scoring is timed; both implementations get the same raw attributes
+    start_time = time.perf_counter()
+    legacy_df = legacy_generate_metadata_output(raw_attributes, num_tokens)
+    legacy_elapsed = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    nft_df = build_metadata_output(raw_attributes, num_tokens)
+    elapsed = time.perf_counter() - start_time
+
+    # Compare the outputs as they would be written to CSV
+    identical = legacy_df.to_csv(index=False) == nft_df.to_csv(index=False)
+
+    print("Legacy merge loop: {:.2f}s".format(legacy_elapsed))
+    print(
+        "Trait matrix:      {:.2f}s ({:.1f}x faster)".format(
+            elapsed, legacy_elapsed / elapsed
+        )
+    )
+    print("Outputs identical: {}".format(identical))
+
+
+if __name__ == "__main__":
+    benchmark_rarity_engine()
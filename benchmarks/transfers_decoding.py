@@ -0,0 +1,98 @@
+import os
+import tempfile
+import time
+
+import click
+
+import jobs.get_nft_transfers as get_nft_transfers_module
+from jobs.get_nft_transfers import get_nft_transfers
+
+PAGE_SIZE = 1000
+
+
+def synthetic_transfer(n):
+    # Build a raw transfer shaped like an alchemy_getAssetTransfers result item
+    transaction_hash = "0x" + format(n, "064x")
+    transfer = {
+        "hash": transaction_hash,
+        "blockNum": hex(15000000 + n // 10),
+        "from": "0x" + format(n % 5000, "040x"),
+        "to": "0x" + format((n + 1) % 5000, "040x"),
+        "uniqueId": transaction_hash + ":log:" + str(n % 300),
+    }
+    if n % 4 == 0:
+        transfer["category"] = "erc1155"
+        transfer["erc1155Metadata"] = [{"tokenId": hex(n % 10000), "value": "0x1"}]
+    else:
+        transfer["category"] = "erc721"
+        transfer["erc721TokenId"] = hex(n % 10000)
+    return transfer
+
+
+class SyntheticResponse(object):
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class SyntheticClient(object):
+    def __init__(self, pages):
+        self._pages = iter(pages)
+
+    def post(self, url, cost=1, **kwargs):
+        return SyntheticResponse(next(self._pages))
+
+
+def synthetic_pages(num_transfers):
+    # Pre-build every page so that only decoding and writing are timed
+    pages = []
+    for page_start in range(0, num_transfers, PAGE_SIZE):
+        page_end = min(page_start + PAGE_SIZE, num_transfers)
+        result = {
+            "transfers": [synthetic_transfer(n) for n in range(page_start, page_end)]
+        }
+        if page_end < num_transfers:
+            result["pageKey"] = str(page_end)
+        pages.append({"result": result})
+    return pages
+
+
+@click.command(context_settings=dict(help_option_names=["-h", "--help"]))
+@click.option(
+    "-n",
+    "--num-transfers",
+    default=500000,
+    show_default=True,
+    type=int,
+    help="The number of synthetic transfers to decode.",
+)
+def benchmark_transfers_decoding(num_transfers):
+    # Serve the synthetic pages in place of Alchemy, without rate limiting
+    get_nft_transfers_module.alchemy_client = SyntheticClient(
+        synthetic_pages(num_transfers)
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = os.path.join(tmp_dir, "transfers.csv")
+
+        start_time = time.perf_counter()
+        get_nft_transfers(
+            start_block=0,
+            end_block=0,
+            api_key="benchmark",
+            contract_address="0x0000000000000000000000000000000000000000",
+            output=output,
+        )
+        elapsed = time.perf_counter() - start_time
+
+    print(
+        "Decoded {} transfers in {:.2f}s ({:,.0f} rows/sec)".format(
+            num_transfers, elapsed, num_transfers / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    benchmark_transfers_decoding()
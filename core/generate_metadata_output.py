@@ -1,134 +1,59 @@
-import copy
-
 import pandas as pd
 
+from core.rarity import (
+    TraitMatrix,
+    attribute_count_rarity_scores,
+    score_rarity_models,
+    trait_rarity_scores,
+)
+from utils.storage import read_table, write_table
+
 
-def generate_metadata_output(raw_attributes_file, token_ids_file, output):
-    # Read from raw attributes file and drop nulls
-    raw_attributes = pd.read_csv(raw_attributes_file)
-    raw_attributes = raw_attributes[raw_attributes["trait_type"].notnull()]
+def generate_metadata_output(
+    raw_attributes_file, token_ids_file, output, rarity_models=()
+):
+    # Read from raw attributes file
+    raw_attributes = read_table(raw_attributes_file)
 
     # Read from token ids file
     token_ids = open(token_ids_file).readlines()
     num_tokens = len(token_ids)
 
-    # Determine the attribute count of each item and calculate rarity
-    attribute_count = (
-        raw_attributes.groupby("asset_id").size().reset_index(name="attribute_count")
-    )
-    attribute_count_rarity = (
-        attribute_count.groupby("attribute_count")
-        .size()
-        .reset_index(name="count_rarity")
-    )
-    attribute_count_rarity["attribute_count_rarity_score"] = 1 / (
-        attribute_count_rarity["count_rarity"] / (num_tokens)
-    )
+    nft_df = build_metadata_output(raw_attributes, num_tokens, rarity_models)
 
-    # Determine the trait for each category and calculate rarity
-    trait_rarity = (
-        raw_attributes.groupby(["trait_type", "value"])
-        .size()
-        .reset_index(name="trait_rarity")
-    )
-    trait_rarity["trait_rarity_score"] = 1 / (
-        trait_rarity["trait_rarity"] / (num_tokens)
-    )
+    # Output metadata to CSV (or Parquet) file
+    write_table(nft_df, output)
 
-    # Calculate the rarity of having (or not having) a trait within each category
-    category_rarity = (
-        trait_rarity[["trait_type", "value", "trait_rarity"]]
-        .groupby("trait_type")
-        .sum("trait_rarity")
-        .reset_index()
-    )
-    category_rarity["category_none_score"] = 1 / (
-        ((num_tokens) - category_rarity["trait_rarity"]) / (num_tokens)
-    )
 
-    # Join and transpose trait data
-    categories = raw_attributes[["asset_id", "value", "trait_type"]]
-    categories = categories.merge(
-        trait_rarity[["trait_type", "value", "trait_rarity_score"]],
-        on=["trait_type", "value"],
-        how="left",
-    )
-    nft_df = copy.deepcopy(attribute_count)
-    nft_df = nft_df.merge(
-        attribute_count_rarity[["attribute_count", "attribute_count_rarity_score"]],
-        on="attribute_count",
-        how="left",
-    )
+def build_metadata_output(raw_attributes, num_tokens, rarity_models=()):
+    # Encode the attributes of all tokens as one token x trait category matrix
+    matrix = TraitMatrix(raw_attributes, num_tokens)
 
-    # Replace spaces and parenthesis in category names
-    categories["trait_type"] = categories["trait_type"].str.replace(
-        " ", "_", regex=True
-    )
-    categories["trait_type"] = categories["trait_type"].str.replace(
-        "\(", "", regex=True
-    )
-    categories["trait_type"] = categories["trait_type"].str.replace(
-        "\)", "", regex=True
-    )
-    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
-        " ", "_", regex=True
-    )
-    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
-        "\(", "", regex=True
-    )
-    category_rarity["trait_type"] = category_rarity["trait_type"].str.replace(
-        "\)", "", regex=True
-    )
+    # Calculate the attribute count rarity and the rarity of each trait
+    trait_scores = trait_rarity_scores(matrix)
 
-    # Drop duplicate categories
-    distinct_trait_types = categories["trait_type"].unique()
+    nft_df = pd.DataFrame(
+        {
+            "asset_id": matrix.asset_ids,
+            "attribute_count": matrix.attribute_counts,
+            "attribute_count_rarity_score": attribute_count_rarity_scores(matrix),
+        }
+    )
 
     # Generate new columns for each trait category
-    df_dict = {}
-    for name in distinct_trait_types:
-        df_dict[name] = pd.DataFrame()
-        df_dict[name] = categories[(categories["trait_type"] == name)]
-        df_dict[name].columns = [
-            "asset_id",
-            "value_" + name,
-            "trait_type_" + name,
-            "trait_rarity_score_" + name,
-        ]
-
-    for name in distinct_trait_types:
-        nft_df = nft_df.merge(df_dict[name], on="asset_id", how="left")
-
-    base_column_names = ["asset_id", "attribute_count", "attribute_count_rarity_score"]
-    trait_column_names = []
-
-    for name in distinct_trait_types:
-        trait_column_names.append(str(name) + "_attribute")
-        trait_column_names.append(str(name))
-        trait_column_names.append(str(name) + "_rarity_score")
-
-    column_names = base_column_names + trait_column_names
-    nft_df.columns = column_names
-
-    category_none_scores = category_rarity[["trait_type", "category_none_score"]]
-
-    for name in distinct_trait_types:
-        nft_df[str(name) + "_rarity_score"] = nft_df[
-            str(name) + "_rarity_score"
-        ].fillna(
-            value=category_none_scores.loc[
-                category_none_scores["trait_type"] == name, "category_none_score"
-            ].iloc[0]
-        )
+    trait_columns = {}
+    for category, name in enumerate(matrix.categories):
+        trait_columns[str(name) + "_attribute"] = matrix.attribute_values(category)
+        trait_columns[str(name) + "_rarity_score"] = trait_scores[:, category]
+    nft_df = pd.concat([nft_df, pd.DataFrame(trait_columns)], axis=1)
 
     # Calculate overall rarity score as the sum of the individual trait rarity scores
     nft_df["overall_rarity_score"] = nft_df[
         [col for col in nft_df.columns if col.endswith("_rarity_score")]
     ].sum(axis=1)
 
-    # Clean up dataframe for output
-    for name in distinct_trait_types:
-        nft_df.drop(columns=[name], axis=1, inplace=True)
-    nft_df = nft_df.drop_duplicates(subset=["asset_id"])
+    # Add a score column for each additional rarity model
+    for model, scores in score_rarity_models(matrix, rarity_models).items():
+        nft_df[model + "_score"] = scores
 
-    # Output metadata to CSV file
-    nft_df.to_csv(output, index=False)
+    return nft_df
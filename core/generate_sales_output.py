@@ -1,28 +1,141 @@
+import os
+
+import numpy as np
 import pandas as pd
 
+from utils.block_date_index import BlockDateIndex
+from utils.block_hour_index import BlockHourIndex
+from utils.external_sort import sort_chunks_to_csv
+from utils.storage import read_table, write_table
+
 pd.options.mode.chained_assignment = None
 
+# Hourly prices more than this many seconds older than a sale are not used for it
+HOURLY_PRICE_TOLERANCE = 2 * 3600
 
-def generate_sales_output(sales_file, date_block_mapping_file, eth_prices_file, output):
-    sales_df = pd.read_csv(sales_file)
 
-    # Read date block mapping and ETH prices from files
-    date_blocks_df = pd.read_csv(date_block_mapping_file)
-    eth_prices_df = pd.read_csv(eth_prices_file)
+def asof_prices(price_timestamps, prices, timestamps, tolerance=HOURLY_PRICE_TOLERANCE):
+    # Latest price at or before each timestamp, NaN where there is none within tolerance
+    # or the timestamp is unknown
+    order = np.argsort(price_timestamps, kind="stable")
+    price_timestamps = np.asarray(price_timestamps, dtype=np.float64)[order]
+    prices = np.asarray(prices, dtype=np.float64)[order]
+    timestamps = np.asarray(timestamps, dtype=np.float64)
 
-    # Transpose data from date block mapping file
-    date_blocks_df.index = pd.IntervalIndex.from_arrays(
-        date_blocks_df["starting_block"], date_blocks_df["ending_block"], closed="both"
-    )
+    result = np.full(len(timestamps), np.nan)
+    if len(prices) == 0:
+        return result
 
-    # Join sales dataframe with date block mapping dataframe
-    sales_df["date"] = sales_df["block_number"].apply(
-        lambda x: date_blocks_df.iloc[date_blocks_df.index.get_loc(x)]["date"]
+    positions = np.searchsorted(price_timestamps, timestamps, side="right") - 1
+    clipped_positions = np.clip(positions, 0, len(prices) - 1)
+    found = (
+        (positions >= 0)
+        & ~np.isnan(timestamps)
+        & (timestamps - price_timestamps[clipped_positions] <= tolerance)
     )
+    result[found] = prices[clipped_positions[found]]
+    return result
+
+
+def generate_sales_output(
+    sales_file,
+    date_block_mapping_file,
+    eth_prices_file,
+    output,
+    date_index=None,
+    hour_block_mapping_file=None,
+    hourly_eth_prices_file=None,
+    timestamp_index=None,
+    chunksize=None,
+):
+    # Read date block mapping and ETH prices from files, unless a prebuilt
+    # block-to-date index is passed in
+    if date_index is None:
+        date_index = BlockDateIndex.from_file(date_block_mapping_file)
+    eth_prices_df = read_table(eth_prices_file)
+
+    # Where hourly data is available, price sales with the ETH price of the hour of
+    # their block instead of the daily price
+    hour_index = None
+    hourly_prices_df = None
+    if (
+        hour_block_mapping_file is not None
+        and hourly_eth_prices_file is not None
+        and os.path.isfile(hour_block_mapping_file)
+        and os.path.isfile(hourly_eth_prices_file)
+    ):
+        hour_index = BlockHourIndex.from_file(hour_block_mapping_file)
+        hourly_prices_df = read_table(hourly_eth_prices_file)
+
+    def enrich(sales_df):
+        return enrich_sales(
+            sales_df,
+            date_index,
+            eth_prices_df,
+            hour_index=hour_index,
+            hourly_prices_df=hourly_prices_df,
+            timestamp_index=timestamp_index,
+        )
+
+    if chunksize is None:
+        sales_df = enrich(read_table(sales_file))
+
+        # Output sales data to CSV (or Parquet) file
+        sales_df = sales_df.sort_values(by=["block_number"], ascending=False)
+        write_table(sales_df, output)
+    else:
+        # Enrich the sales chunksize rows at a time and merge the sorted chunks into
+        # the output CSV, so memory use is bounded by the chunk size
+        sort_chunks_to_csv(
+            (enrich(chunk) for chunk in pd.read_csv(sales_file, chunksize=chunksize)),
+            output,
+            by=["block_number"],
+            ascending=[False],
+        )
+
+
+def enrich_sales(
+    sales_df,
+    date_index,
+    eth_prices_df,
+    hour_index=None,
+    hourly_prices_df=None,
+    timestamp_index=None,
+):
+    # Join sales dataframe with date block mapping
+    sales_df["date"] = date_index.get_dates(sales_df["block_number"], label="sales")
+
+    # Add the exact time of each block, if a block timestamp index is passed in
+    if timestamp_index is not None:
+        sales_df["block_timestamp"] = timestamp_index.get_timestamps(
+            sales_df["block_number"]
+        )
 
     # Join the sales dataframe with ETH price dataframe
     sales_df = sales_df.merge(eth_prices_df, on="date", how="left")
 
+    # Price sales with the ETH price of the hour of their block, where available
+    if hour_index is not None:
+        sale_timestamps = hour_index.get_timestamps(sales_df["block_number"])
+
+        # Exact block times take precedence over the ones interpolated within the hour
+        if timestamp_index is not None:
+            block_timestamps = sales_df["block_timestamp"].to_numpy(
+                dtype=np.float64, na_value=np.nan
+            )
+            sale_timestamps = np.where(
+                np.isnan(block_timestamps), sale_timestamps, block_timestamps
+            )
+
+        hourly_prices = asof_prices(
+            hourly_prices_df["timestamp"],
+            hourly_prices_df["price_of_eth"],
+            sale_timestamps,
+        )
+        sales_df["price_of_eth"] = np.where(
+            np.isnan(hourly_prices), sales_df["price_of_eth"], hourly_prices
+        )
+
     # Calculate USD sale price based on ETH price
     sales_df["sale_price_eth"] = (
         sales_df["seller_fee"] + sales_df["royalty_fee"] + sales_df["protocol_fee"]
@@ -38,11 +151,12 @@ def generate_sales_output(sales_file, date_block_mapping_file, eth_prices_file,
     sales_df["royalty_fee_usd"] = sales_df["royalty_fee_eth"] * sales_df["price_of_eth"]
 
     # Clean up dataframe for output
-    sales_df = sales_df[
+    return sales_df[
         [
             "transaction_hash",
             "block_number",
             "date",
+            *(["block_timestamp"] if timestamp_index is not None else []),
             "asset_id",
             "marketplace",
             "seller",
@@ -58,7 +172,3 @@ def generate_sales_output(sales_file, date_block_mapping_file, eth_prices_file,
             "quantity",
         ]
     ]
-
-    # Output sales data to CSV file
-    sales_df = sales_df.sort_values(by=["block_number"], ascending=False)
-    sales_df.to_csv(output, index=False)
@@ -1,33 +1,68 @@
 import pandas as pd
 
+from utils.block_date_index import BlockDateIndex
+from utils.external_sort import sort_chunks_to_csv
+from utils.storage import read_table, write_table
 
-def generate_transfers_output(transfers_file, date_block_mapping_file, output):
-    # Read from transfers file and extract relevant columns
-    transfers_df = pd.read_csv(transfers_file)
 
-    # Read from date block mapping file and transpose data
-    date_blocks_df = pd.read_csv(date_block_mapping_file)
+def generate_transfers_output(
+    transfers_file,
+    date_block_mapping_file,
+    output,
+    date_index=None,
+    timestamp_index=None,
+    chunksize=None,
+):
+    # Read from date block mapping file, unless a prebuilt block-to-date index is passed in
+    if date_index is None:
+        date_index = BlockDateIndex.from_file(date_block_mapping_file)
 
-    date_blocks_df.index = pd.IntervalIndex.from_arrays(
-        date_blocks_df["starting_block"], date_blocks_df["ending_block"], closed="both"
-    )
+    if chunksize is None:
+        # Read from transfers file and extract relevant columns
+        transfers_df = enrich_transfers(
+            read_table(transfers_file), date_index, timestamp_index
+        )
 
-    # Join transfers dataframe with date block mapping dataframe
-    transfers_df["date"] = transfers_df["block_number"].apply(
-        lambda x: date_blocks_df.iloc[date_blocks_df.index.get_loc(x)]["date"]
-    )
+        # Clean up dataframe for output
+        transfers_df = transfers_df.sort_values(
+            by=["block_number", "log_index"], ascending=[False, True]
+        )
+
+        # Output transfers data to CSV (or Parquet) file
+        write_table(transfers_df, output)
+    else:
+        # Enrich the transfers chunksize rows at a time and merge the sorted chunks
+        # into the output CSV, so memory use is bounded by the chunk size
+        sort_chunks_to_csv(
+            (
+                enrich_transfers(chunk, date_index, timestamp_index)
+                for chunk in pd.read_csv(transfers_file, chunksize=chunksize)
+            ),
+            output,
+            by=["block_number", "log_index"],
+            ascending=[False, True],
+        )
 
-    # Clean up dataframe for output
-    transfers_df = transfers_df.sort_values(
-        by=["block_number", "log_index"], ascending=[False, True]
+
+def enrich_transfers(transfers_df, date_index, timestamp_index=None):
+    # Join transfers dataframe with date block mapping
+    transfers_df["date"] = date_index.get_dates(
+        transfers_df["block_number"], label="transfers"
     )
 
+    # Add the exact time of each block, if a block timestamp index is passed in
+    if timestamp_index is not None:
+        transfers_df["block_timestamp"] = timestamp_index.get_timestamps(
+            transfers_df["block_number"]
+        )
+
     # ERC-721 transfers; exclude num_tokens field
-    transfers_df = transfers_df[
+    return transfers_df[
         [
             "transaction_hash",
             "block_number",
             "date",
+            *(["block_timestamp"] if timestamp_index is not None else []),
             "asset_id",
             "from_address",
             "to_address",
@@ -35,6 +70,3 @@ def generate_transfers_output(transfers_file, date_block_mapping_file, output):
             "value",
         ]
     ]
-
-    # Output transfers data to CSV file
-    transfers_df.to_csv(output, index=False)
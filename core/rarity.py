@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+
+
+def clean_category_names(trait_types):
+    # Replace spaces and parenthesis in category names
+    names = pd.Series(trait_types, dtype=object)
+    names = names.str.replace(" ", "_", regex=False)
+    names = names.str.replace("(", "", regex=False)
+    names = names.str.replace(")", "", regex=False)
+    return names.to_numpy(dtype=object)
+
+
+class TraitMatrix(object):
+    def __init__(self, raw_attributes, num_tokens):
+        """Integer-encoded token x trait category matrix built in one pass over the raw attributes.
+        Tokens are sorted by asset_id and categories keep the order in which they first appear.
+        Each cell points at the raw attribute row holding the token's trait for that category,
+        or -1 when the token does not have the category
+        """
+        raw_attributes = raw_attributes[raw_attributes["trait_type"].notnull()]
+        self.num_tokens = num_tokens
+        # Extension arrays (e.g. Arrow-backed strings) are kept as they are, since
+        # converting them to NumPy for every category dominates the run time
+        values = raw_attributes["value"]
+        if isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            self.values = values.array
+        else:
+            self.values = values.to_numpy()
+
+        # Encode tokens and count the attributes of each token
+        asset_codes, self.asset_ids = pd.factorize(
+            raw_attributes["asset_id"], sort=True
+        )
+        self.attribute_counts = np.bincount(asset_codes, minlength=len(self.asset_ids))
+
+        # Encode (trait_type, value) pairs and count how many rows share each pair.
+        # Rows without a value belong to the category but not to any trait.
+        type_codes, trait_types = pd.factorize(raw_attributes["trait_type"], sort=True)
+        value_codes, values = pd.factorize(raw_attributes["value"])
+        has_value = value_codes >= 0
+        pair_codes, _ = pd.factorize(
+            type_codes[has_value].astype(np.int64) * max(len(values), 1)
+            + value_codes[has_value]
+        )
+        self.row_trait_codes = np.full(len(raw_attributes), -1, dtype=np.int64)
+        self.row_trait_codes[has_value] = pair_codes
+        self.trait_counts = np.bincount(pair_codes)
+
+        # Trait types that only differ in spaces and parenthesis share one category,
+        # whose totals are taken from the first of them in sorted order
+        names = clean_category_names(trait_types)
+        category_codes, self.categories = pd.factorize(names[type_codes])
+        first_type_of_category = np.full(len(self.categories), -1, dtype=np.int64)
+        type_category_codes = pd.Index(self.categories).get_indexer(names)
+        for type_code in range(len(trait_types) - 1, -1, -1):
+            first_type_of_category[type_category_codes[type_code]] = type_code
+        type_counts = np.bincount(type_codes[has_value], minlength=len(trait_types))
+        self.category_counts = type_counts[first_type_of_category]
+
+        # Point each cell at the first raw row of the token for that category
+        keys = asset_codes.astype(np.int64) * len(self.categories) + category_codes
+        unique_keys, first_rows = np.unique(keys, return_index=True)
+        self.rows = np.full(
+            (len(self.asset_ids), len(self.categories)), -1, dtype=np.int64
+        )
+        self.rows.flat[unique_keys] = first_rows
+
+    def trait_codes(self):
+        # Trait code of each cell, -1 where the token has no trait in the category
+        codes = np.full(self.rows.shape, -1, dtype=np.int64)
+        present = self.rows >= 0
+        codes[present] = self.row_trait_codes[self.rows[present]]
+        return codes
+
+    def attribute_values(self, category):
+        # The raw attribute values of one category, NaN where a token does not have it
+        return pd.api.extensions.take(
+            self.values, self.rows[:, category], allow_fill=True
+        )
+
+
+def attribute_count_frequencies(matrix):
+    # Share of tokens with the same number of attributes as each token
+    count_frequencies = np.bincount(matrix.attribute_counts)
+    return count_frequencies[matrix.attribute_counts] / matrix.num_tokens
+
+
+def trait_frequencies(matrix):
+    # Share of tokens with each token's trait, or share of tokens without any
+    # trait in the category when the token does not have one
+    codes = matrix.trait_codes()
+    shares = matrix.trait_counts / matrix.num_tokens
+    none_shares = (matrix.num_tokens - matrix.category_counts) / matrix.num_tokens
+    return np.where(
+        codes >= 0, shares[np.maximum(codes, 0)] if len(shares) else np.nan, none_shares
+    )
+
+
+def category_sizes(codes):
+    # Number of distinct traits in each column of a trait code matrix, counting
+    # "no trait" as one more when some token lacks the category
+    if codes.size == 0:
+        return np.zeros(codes.shape[1], dtype=np.int64)
+    num_columns = codes.shape[1]
+    keys = (codes.astype(np.int64) + 1) * num_columns + np.arange(num_columns)
+    return np.bincount(np.unique(keys) % num_columns, minlength=num_columns)
+
+
+def attribute_count_rarity_scores(matrix):
+    # 1 / (share of tokens with the same number of attributes)
+    return 1 / attribute_count_frequencies(matrix)
+
+
+def trait_rarity_scores(matrix):
+    # 1 / (share of tokens with the trait), or 1 / (share of tokens without any
+    # trait in the category) when the token does not have one
+    with np.errstate(divide="ignore"):
+        return 1 / trait_frequencies(matrix)
+
+
+class TraitFrequencies(object):
+    def __init__(self, matrix):
+        """Shared input of the rarity models: for every token, the share of tokens with
+        the same attribute count (first column) and with the same trait in each category,
+        plus the number of distinct values of each column
+        """
+        counts = matrix.attribute_counts.reshape(-1, 1)
+        self.frequencies = np.hstack(
+            [
+                attribute_count_frequencies(matrix).reshape(-1, 1),
+                trait_frequencies(matrix),
+            ]
+        )
+        self.sizes = category_sizes(np.hstack([counts, matrix.trait_codes()]))
+
+
+def harmonic_rarity(traits):
+    # Sum of 1 / frequency, the overall_rarity_score of the metadata output
+    with np.errstate(divide="ignore"):
+        return (1 / traits.frequencies).sum(axis=1)
+
+
+def information_content_rarity(traits):
+    # Sum of -log2(frequency): the information needed to single out each trait
+    with np.errstate(divide="ignore"):
+        return (-np.log2(traits.frequencies)).sum(axis=1)
+
+
+def normalized_rarity(traits):
+    # Sum of 1 / frequency, with each category divided by its number of distinct values
+    # so that categories with many traits do not dominate the score
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (1 / traits.frequencies / traits.sizes).sum(axis=1)
+
+
+def rank_percentile_rarity(traits):
+    # Percentage of tokens whose harmonic score is at most the token's own score
+    return (
+        pd.Series(harmonic_rarity(traits)).rank(method="max", pct=True).to_numpy() * 100
+    )
+
+
+RARITY_MODELS = {
+    "harmonic": harmonic_rarity,
+    "information_content": information_content_rarity,
+    "normalized": normalized_rarity,
+    "rank_percentile": rank_percentile_rarity,
+}
+
+
+def score_rarity_models(matrix, models):
+    # Evaluate several rarity models over the same trait frequencies, each one a
+    # single reduction over the token x category matrix
+    traits = TraitFrequencies(matrix)
+    return {model: RARITY_MODELS[model](traits) for model in models}
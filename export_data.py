@@ -1,26 +1,44 @@
 import contextlib
-import sys
+import os
+import shutil
 import tempfile
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 
 import click
+import pandas as pd
 from web3 import Web3
 
 from core.generate_metadata_output import generate_metadata_output
 from core.generate_sales_output import generate_sales_output
 from core.generate_transfers_output import generate_transfers_output
+from core.rarity import RARITY_MODELS
 from jobs.cleanup_outputs import clean_up_outputs
 from jobs.export_update_logs import export_update_logs
-from jobs.get_nft_metadata import get_metadata_for_collection
+from jobs.get_nft_metadata import get_metadata_for_collection, get_metadata_for_tokens
 from jobs.get_nft_sales import get_nft_sales
-from jobs.get_nft_transfers import get_nft_transfers
+from jobs.get_nft_transfers import get_nft_transfers, get_nft_transfers_for_contracts
 from jobs.get_recent_block import get_recent_block
-from jobs.update_block_to_date_mapping import update_block_to_date_mapping
-from jobs.update_eth_prices import update_eth_prices
+from jobs.update_block_to_date_mapping import (
+    get_provisional_date_block_mapping,
+    update_block_to_date_mapping,
+)
+from jobs.update_eth_prices import update_eth_prices, update_hourly_eth_prices
+from jobs.update_hour_block_mapping import update_hour_block_mapping
+from utils.block_date_index import BlockDateIndex
+from utils.block_timestamp_index import BlockTimestampIndex
 from utils.check_contract_support import check_contract_support
+from utils.checkpoint import RunCheckpoint
+from utils.eth_price_sources import CsvPriceSource
 from utils.eth_service import EthService
 from utils.extract_unique_column_value import extract_unique_column_value
+from utils.json_rpc import JsonRpcBatchClient, RateLimitedHTTPProvider
+from utils.metadata_store import MetadataStore
+from utils.rate_limiter import alchemy_rate_limiter, coingecko_rate_limiter
+from utils.stage_graph import StageGraph
+from utils.storage import dataset_path, read_table, require_pyarrow
 
 
 # Set click CLI parameters
@@ -35,139 +53,844 @@ from utils.extract_unique_column_value import extract_unique_column_value
 @click.option(
     "-c",
     "--contract-address",
-    required=True,
+    "contract_addresses",
+    multiple=True,
     type=str,
-    help="The contract address of the desired NFT collection.",
+    help="The contract address of the desired NFT collection. Repeat to export several collections.",
+)
+@click.option(
+    "--contracts-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="A file listing one contract address per line to export in a single batch.",
+)
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    type=int,
+    help="The number of collections exported concurrently in batch mode.",
+)
+@click.option(
+    "--prefetch-depth",
+    default=2,
+    show_default=True,
+    type=int,
+    help="The number of Alchemy pages to fetch ahead while the current page is processed.",
+)
+@click.option(
+    "--shards",
+    default=1,
+    show_default=True,
+    type=int,
+    help="The number of block sub-ranges to fetch transfers and sales for concurrently.",
+)
+@click.option(
+    "--alchemy-compute-units-per-second",
+    default=330,
+    show_default=True,
+    type=int,
+    help="The Alchemy compute unit budget shared by all concurrent requests.",
+)
+@click.option(
+    "--coingecko-calls-per-minute",
+    default=10,
+    show_default=True,
+    type=float,
+    help="The CoinGecko API call budget used when updating ETH prices.",
+)
+@click.option(
+    "--eth-prices-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="A local CSV file with date and price_of_eth columns to update ETH prices "
+    "from, instead of the CoinGecko API.",
+)
+@click.option(
+    "--hourly-prices",
+    is_flag=True,
+    help="Price sales with the ETH price of the hour they happened in, where available. "
+    "Keeps hourly CoinGecko prices and a block-to-hour mapping in ./raw-data, "
+    "starting with the last 90 days.",
+)
+@click.option(
+    "--block-timestamps",
+    is_flag=True,
+    help="Add the unix timestamp of each block to the transfers and sales outputs. "
+    "Timestamps are kept in a local block timestamp index in ./raw-data.",
+)
+@click.option(
+    "--rpc-batch-size",
+    default=8,
+    show_default=True,
+    type=int,
+    help="The number of blocks probed per batched JSON-RPC request when searching for blocks.",
+)
+@click.option(
+    "--storage-format",
+    default="csv",
+    show_default=True,
+    type=click.Choice(["csv", "parquet"]),
+    help="How consolidated sales, transfers and metadata are stored. "
+    "Parquet datasets are written to ./datasets and rendered to the CSV outputs.",
+)
+@click.option(
+    "--output-chunksize",
+    default=None,
+    type=int,
+    help="Generate the sales and transfers outputs this many rows at a time, with an "
+    "external merge sort, so that memory use is bounded for very large histories.",
+)
+@click.option(
+    "--metadata-refresh",
+    default=None,
+    type=click.Choice(["full", "incremental"]),
+    help="Refetch the whole collection's metadata on every run, or only fetch tokens "
+    "missing from the metadata store in ./metadata-store. Defaults to full, or to "
+    "incremental in tail mode.",
+)
+@click.option(
+    "--metadata-concurrency",
+    default=1,
+    show_default=True,
+    type=int,
+    help="The number of token ID ranges to fetch collection metadata for concurrently.",
+)
+@click.option(
+    "--full-sweep-days",
+    default=None,
+    type=int,
+    help="In incremental mode, refetch the whole collection when the last full sweep "
+    "is at least this many days old.",
+)
+@click.option(
+    "--rarity-model",
+    "rarity_models",
+    multiple=True,
+    type=click.Choice(list(RARITY_MODELS)),
+    help="An additional rarity model to score tokens with, written to a <model>_score "
+    "column of the metadata output. Repeat to add several models.",
+)
+@click.option(
+    "--tail",
+    is_flag=True,
+    help="Keep running and sync the outputs up to the chain head at a fixed interval, "
+    "instead of exporting up to the end of yesterday once.",
+)
+@click.option(
+    "--tail-interval",
+    default=300,
+    show_default=True,
+    type=int,
+    help="In tail mode, the number of seconds between updates.",
+)
+@click.option(
+    "--confirmations",
+    default=12,
+    show_default=True,
+    type=int,
+    help="In tail mode, the number of blocks behind the latest block to sync up to.",
 )
-def export_data(contract_address, alchemy_api_key):
+@click.option(
+    "--reorg-window",
+    default=12,
+    show_default=True,
+    type=int,
+    help="In tail mode, the number of blocks before the last synced block that are "
+    "fetched again on every update, in case they were reorganized.",
+)
+def export_data(
+    contract_addresses,
+    contracts_file,
+    workers,
+    alchemy_api_key,
+    prefetch_depth,
+    shards,
+    alchemy_compute_units_per_second,
+    coingecko_calls_per_minute,
+    eth_prices_file,
+    hourly_prices,
+    block_timestamps,
+    rpc_batch_size,
+    storage_format,
+    output_chunksize,
+    metadata_refresh,
+    metadata_concurrency,
+    full_sweep_days,
+    rarity_models,
+    tail,
+    tail_interval,
+    confirmations,
+    reorg_window,
+):
     if (alchemy_api_key is None) or (alchemy_api_key == ""):
         raise Exception("Alchemy API key is required.")
 
-    # Convert address to checksummed address (a specific pattern of uppercase and lowercase letters)
-    contract_address = Web3.to_checksum_address(contract_address)
+    if storage_format == "parquet":
+        require_pyarrow()
+
+    # Collect contract addresses from the command line and the contracts file
+    contract_addresses = list(contract_addresses)
+    if contracts_file:
+        with open(contracts_file) as f:
+            contract_addresses += [line.strip() for line in f if line.strip()]
+    if len(contract_addresses) == 0:
+        raise Exception("At least one contract address is required.")
 
-    # Check if contract address is supported by Alchemy
-    check_contract_support(
-        alchemy_api_key=alchemy_api_key, contract_address=contract_address
+    # Convert addresses to checksummed addresses (a specific pattern of uppercase and lowercase letters)
+    contract_addresses = list(
+        dict.fromkeys(Web3.to_checksum_address(c) for c in contract_addresses)
     )
 
-    warnings.simplefilter(action="ignore", category=FutureWarning)
-    print("Process started for contract address: " + str(contract_address))
+    # Check if contract addresses are supported by Alchemy
+    for contract_address in contract_addresses:
+        check_contract_support(
+            alchemy_api_key=alchemy_api_key, contract_address=contract_address
+        )
+
+    # Share one API budget per provider across all concurrent requests
+    alchemy_rate_limiter.set_rate(alchemy_compute_units_per_second)
+    coingecko_rate_limiter.set_rate(coingecko_calls_per_minute / 60, capacity=1)
 
-    # Get current timestamp
-    right_now = str(datetime.now().timestamp())
+    warnings.simplefilter(action="ignore", category=FutureWarning)
 
     # Assign file paths (persisting files only)
     date_block_mapping_csv = "./raw-data/date_block_mapping.csv"
     eth_prices_csv = "./raw-data/eth_prices.csv"
-    sales_csv = "sales_" + contract_address + "_" + right_now + ".csv"
-    metadata_csv = "metadata_" + contract_address + ".csv"
-    transfers_csv = "transfers_" + contract_address + "_" + right_now + ".csv"
-    updates_csv = "./update-logs/" + contract_address + ".csv"
-    all_transfers_csv = "transfers_" + contract_address + ".csv"
+    block_timestamps_cache = "./raw-data/block_timestamps.sqlite"
+    hour_block_mapping_csv = None
+    hourly_eth_prices_csv = None
+    if hourly_prices:
+        hour_block_mapping_csv = "./raw-data/hour_block_mapping.csv"
+        hourly_eth_prices_csv = "./raw-data/eth_prices_hourly.csv"
 
     # Set provider
     provider_uri = "https://eth-mainnet.alchemyapi.io/v2/" + alchemy_api_key
-    web3 = Web3(Web3.HTTPProvider(provider_uri))
-    eth_service = EthService(web3)
+    web3 = Web3(RateLimitedHTTPProvider(provider_uri))
+    rpc = JsonRpcBatchClient(provider_uri)
+    timestamp_index = BlockTimestampIndex() if block_timestamps else None
+    eth_service = EthService(
+        web3,
+        rpc=rpc,
+        batch_size=rpc_batch_size,
+        cache_file=block_timestamps_cache,
+        timestamp_index=timestamp_index,
+    )
 
-    # Get block range
-    # If update logs exist, read from the saved file and set the start block
-    start_block = get_recent_block(updates_csv, contract_address, web3)
+    # ETH prices come from CoinGecko unless a local price file is given
+    price_sources = None
+    if eth_prices_file:
+        price_sources = [CsvPriceSource(eth_prices_file)]
+
+    if metadata_refresh is None:
+        metadata_refresh = "incremental" if tail else "full"
+
+    export_options = dict(
+        alchemy_api_key=alchemy_api_key,
+        web3=web3,
+        rpc=rpc,
+        date_block_mapping_csv=date_block_mapping_csv,
+        eth_prices_csv=eth_prices_csv,
+        hour_block_mapping_csv=hour_block_mapping_csv,
+        hourly_eth_prices_csv=hourly_eth_prices_csv,
+        timestamp_service=eth_service if block_timestamps else None,
+        prefetch_depth=prefetch_depth,
+        shards=shards,
+        rpc_batch_size=rpc_batch_size,
+        storage_format=storage_format,
+        output_chunksize=output_chunksize,
+        metadata_refresh=metadata_refresh,
+        metadata_concurrency=metadata_concurrency,
+        full_sweep_days=full_sweep_days,
+        rarity_models=rarity_models,
+    )
+
+    if tail:
+        tail_contracts(
+            contract_addresses,
+            workers=workers,
+            eth_service=eth_service,
+            interval=tail_interval,
+            confirmations=confirmations,
+            reorg_window=reorg_window,
+            price_sources=price_sources,
+            **export_options,
+        )
+        return
 
+    # Get the end of the block range, shared by all contracts
     yesterday = datetime.today() - timedelta(days=1)
     _, end_block = eth_service.get_block_range_for_date(yesterday)
 
-    # If start_block == end_block, then data is already up to date
-    if start_block == end_block:
-        print("Data is up to date. No updates required.")
-        sys.exit(0)
-
-    # Create tempfiles
-    with tempfile.NamedTemporaryFile(
-        delete=False
-    ) as nft_sales_csv, tempfile.NamedTemporaryFile(
-        delete=False
-    ) as nft_transfers_csv, tempfile.NamedTemporaryFile(
-        delete=False
-    ) as all_token_ids_txt, tempfile.NamedTemporaryFile(
-        delete=False
-    ) as raw_attributes_csv:
-        with contextlib.redirect_stderr(None):
-            # Export transfers
-            get_nft_transfers(
-                start_block=start_block,
+    # Update reference data shared by all contracts once per run. A single contract's
+    # export runs concurrently with it, as it is only needed once its transfers and
+    # sales are fetched; a batch of contracts is exported once it is up to date
+    graph = StageGraph()
+    graph.add(
+        "block_date_mapping",
+        lambda: update_block_to_date_mapping(
+            filename=date_block_mapping_csv, eth_service=eth_service
+        ),
+    )
+    graph.add(
+        "eth_prices",
+        lambda: update_eth_prices(filename=eth_prices_csv, sources=price_sources),
+    )
+
+    # Build the block-to-date index once for all output generators
+    graph.add(
+        "date_index",
+        lambda: BlockDateIndex.from_file(date_block_mapping_csv),
+        depends_on=["block_date_mapping"],
+    )
+    reference_stages = ["date_index", "eth_prices"]
+
+    if hourly_prices:
+        # Block searches share the ETH service, so they do not run concurrently
+        graph.add(
+            "hour_block_mapping",
+            lambda: update_hour_block_mapping(
+                filename=hour_block_mapping_csv, eth_service=eth_service
+            ),
+            depends_on=["block_date_mapping"],
+        )
+        graph.add(
+            "hourly_eth_prices",
+            lambda: update_hourly_eth_prices(filename=hourly_eth_prices_csv),
+        )
+        reference_stages += ["hour_block_mapping", "hourly_eth_prices"]
+
+    if len(contract_addresses) == 1:
+        # Sharded fetches split their block range by the date block mapping
+        export_contract(
+            contract_address=contract_addresses[0],
+            end_block=end_block,
+            date_index=None,
+            graph=graph,
+            fetch_after=["block_date_mapping"] if shards > 1 else [],
+            consolidate_after=reference_stages,
+            **export_options,
+        )
+    else:
+        graph.add(
+            "contracts",
+            lambda: export_contracts(
+                contract_addresses,
+                workers=workers,
                 end_block=end_block,
-                api_key=alchemy_api_key,
+                date_index=graph.results["date_index"],
+                **export_options,
+            ),
+            depends_on=reference_stages,
+        )
+
+    # stderr is redirected once for the whole graph, since swapping it per stage
+    # is not thread-safe
+    with contextlib.redirect_stderr(None):
+        graph.run()
+    print(graph.timing_summary())
+
+
+def run_exports(contract_addresses, workers, **export_options):
+    if len(contract_addresses) == 1:
+        export_contract(contract_address=contract_addresses[0], **export_options)
+    else:
+        export_contracts(contract_addresses, workers=workers, **export_options)
+
+
+def tail_contracts(
+    contract_addresses,
+    workers,
+    eth_service,
+    interval,
+    confirmations,
+    reorg_window,
+    web3,
+    date_block_mapping_csv,
+    eth_prices_csv,
+    hour_block_mapping_csv=None,
+    hourly_eth_prices_csv=None,
+    price_sources=None,
+    **export_options,
+):
+    # Sync the outputs up to latest - confirmations every interval seconds. Each update
+    # fetches the blocks since the last logged block plus a reorg window before it, and
+    # the consolidated outputs replace their rows from that block onwards.
+    while True:
+        cycle_start = time.perf_counter()
+        try:
+            end_block = web3.eth.block_number - confirmations
+
+            # Complete days are persisted as usual; blocks of the current day are dated
+            # with a provisional mapping row that only lives for this update
+            update_block_to_date_mapping(
+                filename=date_block_mapping_csv, eth_service=eth_service
+            )
+            update_eth_prices(filename=eth_prices_csv, sources=price_sources)
+            if hour_block_mapping_csv is not None:
+                update_hour_block_mapping(
+                    filename=hour_block_mapping_csv, eth_service=eth_service
+                )
+                update_hourly_eth_prices(filename=hourly_eth_prices_csv)
+            date_blocks_df = read_table(date_block_mapping_csv)
+            provisional_df = get_provisional_date_block_mapping(
+                eth_service, web3, end_block
+            )
+            date_blocks_df = pd.concat(
+                [
+                    date_blocks_df,
+                    provisional_df[
+                        ~provisional_df["date"].isin(date_blocks_df["date"])
+                    ],
+                ],
+                ignore_index=True,
+            )
+
+            run_exports(
+                contract_addresses,
+                workers=workers,
+                web3=web3,
+                end_block=end_block,
+                date_index=BlockDateIndex(date_blocks_df),
+                date_block_mapping_csv=date_block_mapping_csv,
+                eth_prices_csv=eth_prices_csv,
+                hour_block_mapping_csv=hour_block_mapping_csv,
+                hourly_eth_prices_csv=hourly_eth_prices_csv,
+                reorg_window=reorg_window,
+                **export_options,
+            )
+            print("Synced up to block {}".format(end_block))
+        except Exception as e:
+            # Interrupted runs resume from their checkpoints in the next update
+            print("Update failed: {}".format(e))
+
+        wait = max(interval - (time.perf_counter() - cycle_start), 0)
+        print("Next update in {:.0f}s".format(wait))
+        time.sleep(wait)
+
+
+def export_contracts(contract_addresses, workers, **export_options):
+    # Schedule per-contract exports across a worker pool. All workers share the
+    # provider rate limiters, so the pool stays within one global API budget.
+    print(
+        "Exporting {} contracts with {} workers...".format(
+            len(contract_addresses), workers
+        )
+    )
+    results = {}
+    batch_start = time.perf_counter()
+
+    def run(contract_address):
+        start = time.perf_counter()
+        try:
+            export_contract(
                 contract_address=contract_address,
-                output=nft_transfers_csv.name,
+                suppress_stderr=False,
+                **shared_transfers.get(contract_address, {}),
+                **export_options,
+            )
+            return "ok", time.perf_counter() - start
+        except Exception as e:
+            return "failed: {}".format(e), time.perf_counter() - start
+
+    # stderr is redirected once for the whole pool, since swapping it per job
+    # is not thread-safe
+    with contextlib.redirect_stderr(
+        None
+    ), tempfile.TemporaryDirectory() as transfers_dir, ThreadPoolExecutor(
+        max_workers=max(workers, 1)
+    ) as executor:
+        # Contracts updated over the same block window share transfer fetches
+        shared_transfers = prefetch_transfers_for_shared_windows(
+            contract_addresses, transfers_dir, **export_options
+        )
+
+        futures = {executor.submit(run, c): c for c in contract_addresses}
+        for future in as_completed(futures):
+            contract_address = futures[future]
+            results[contract_address] = future.result()
+            print(
+                "[{}/{}] {} {} in {:.1f}s".format(
+                    len(results),
+                    len(contract_addresses),
+                    contract_address,
+                    *results[contract_address],
+                )
+            )
+
+    # Print per-contract timing summary
+    print("Batch finished in {:.1f}s".format(time.perf_counter() - batch_start))
+    for contract_address in contract_addresses:
+        status, elapsed = results[contract_address]
+        print("  {}  {:>8.1f}s  {}".format(contract_address, elapsed, status))
+
+    num_failed = sum(1 for status, _ in results.values() if status != "ok")
+    if num_failed > 0:
+        raise Exception("{} of {} contracts failed.".format(num_failed, len(results)))
+
+
+def update_log_path(contract_address):
+    return "./update-logs/" + contract_address + ".csv"
+
+
+def prefetch_transfers_for_shared_windows(
+    contract_addresses,
+    transfers_dir,
+    alchemy_api_key,
+    web3,
+    rpc,
+    end_block,
+    prefetch_depth=2,
+    rpc_batch_size=1,
+    reorg_window=0,
+    **export_options,
+):
+    # Group contracts by the block their update starts from, and fetch the transfers of
+    # each group with a single alchemy_getAssetTransfers cursor, so that a daily update
+    # costs pages proportional to total activity instead of one request per contract.
+    # Returns the start block of each contract, and the transfers file of contracts
+    # fetched together, to pass to export_contract, so that start blocks are only
+    # looked up once. Contracts with an interrupted run resume from their own
+    # checkpoints instead
+    start_blocks = {
+        c: get_recent_block(
+            update_log_path(c), c, web3, rpc=rpc, batch_size=rpc_batch_size
+        )
+        for c in contract_addresses
+        if not RunCheckpoint.exists(c)
+    }
+    groups = {}
+    for c, start_block in start_blocks.items():
+        if start_block < end_block:
+            groups.setdefault(start_block, []).append(c)
+
+    shared_transfers = {
+        c: dict(start_block=start_block) for c, start_block in start_blocks.items()
+    }
+    for start_block, group in groups.items():
+        if len(group) < 2:
+            continue
+
+        outputs = {
+            c: os.path.join(transfers_dir, "transfers_" + c + ".csv") for c in group
+        }
+        try:
+            get_nft_transfers_for_contracts(
+                start_block=max(start_block - reorg_window, 0),
+                end_block=end_block,
+                api_key=alchemy_api_key,
+                outputs=outputs,
+                prefetch_depth=prefetch_depth,
+            )
+        except Exception as e:
+            print(
+                "Shared transfers fetch failed ({}); fetching per contract instead.".format(
+                    e
+                )
+            )
+            continue
+
+        for c in group:
+            shared_transfers[c]["transfers_file"] = outputs[c]
+
+    return shared_transfers
+
+
+def export_contract(
+    contract_address,
+    alchemy_api_key,
+    web3,
+    rpc,
+    end_block,
+    date_index,
+    date_block_mapping_csv,
+    eth_prices_csv,
+    hour_block_mapping_csv=None,
+    hourly_eth_prices_csv=None,
+    timestamp_service=None,
+    prefetch_depth=2,
+    shards=1,
+    rpc_batch_size=1,
+    storage_format="csv",
+    output_chunksize=None,
+    metadata_refresh="full",
+    metadata_concurrency=1,
+    full_sweep_days=None,
+    rarity_models=(),
+    reorg_window=0,
+    suppress_stderr=True,
+    start_block=None,
+    transfers_file=None,
+    graph=None,
+    fetch_after=(),
+    consolidate_after=(),
+):
+    # start_block and transfers_file may be passed in when transfers were already
+    # fetched together with other contracts. With a reorg window, the blocks before
+    # start_block are fetched again and replace the previously exported rows.
+    # When a stage graph is passed in, the export's stages are added to it instead of
+    # being run, after the graph's fetch_after and consolidate_after stages; date_index
+    # may then be None and is taken from the graph's date_index stage. With a
+    # timestamp_service, the timestamps of the run's blocks are added to its block
+    # timestamp index and to the outputs.
+    print("Process started for contract address: " + str(contract_address))
+
+    # Get block range
+    # If update logs exist, read from the saved file and set the start block
+    updates_csv = update_log_path(contract_address)
+    if start_block is None:
+        start_block = get_recent_block(
+            updates_csv, contract_address, web3, rpc=rpc, batch_size=rpc_batch_size
+        )
+
+    # Resume the previous run if it failed, keeping its block range
+    checkpoint = RunCheckpoint(contract_address, start_block, end_block)
+    if checkpoint.resumed:
+        print(
+            "Resuming interrupted run for blocks {}-{}".format(
+                checkpoint.start_block, checkpoint.end_block
             )
+        )
+        end_block = checkpoint.end_block
+        transfers_file = None
+
+    # If start_block >= end_block, then data is already up to date
+    if start_block >= end_block:
+        checkpoint.clear()
+        print("Data is up to date. No updates required.")
+        return
+
+    start_block = max(start_block - reorg_window, 0)
+
+    # Assign file paths (persisting files only). The run id is kept by the checkpoint,
+    # so that a resumed run overwrites the run files of the interrupted one.
+    run_id = checkpoint.run_id
+    sales_csv = "sales_" + contract_address + "_" + run_id + ".csv"
+    metadata_csv = "metadata_" + contract_address + ".csv"
+    transfers_csv = "transfers_" + contract_address + "_" + run_id + ".csv"
+    all_transfers_csv = "transfers_" + contract_address + ".csv"
+
+    # Parquet storage keeps consolidated data in partitioned datasets
+    if storage_format == "parquet":
+        all_transfers_data = dataset_path("transfers", contract_address)
+        metadata_data = os.path.join(
+            dataset_path("metadata", contract_address), "metadata.parquet"
+        )
+    else:
+        all_transfers_data = all_transfers_csv
+        metadata_data = metadata_csv
+
+    # Intermediate files live in the checkpoint directory until the run completes
+    nft_transfers_csv = checkpoint.path("transfers.csv")
+    nft_sales_csv = checkpoint.path("sales.csv")
+    all_token_ids_txt = checkpoint.path("token_ids.txt")
+    raw_attributes_csv = checkpoint.path("raw_attributes.csv")
 
-        with contextlib.redirect_stderr(None):
-            # Export sales
-            get_nft_sales(
+    def quiet():
+        if suppress_stderr:
+            return contextlib.redirect_stderr(None)
+        return contextlib.nullcontext()
+
+    # Each stage is skipped when a previous attempt of this run already completed it
+    def fetch_transfers():
+        if checkpoint.is_done("transfers"):
+            return
+        if transfers_file is not None:
+            shutil.copyfile(transfers_file, nft_transfers_csv)
+        else:
+            # Export transfers
+            get_nft_transfers(
                 start_block=start_block,
                 end_block=end_block,
                 api_key=alchemy_api_key,
                 contract_address=contract_address,
-                output=nft_sales_csv.name,
+                output=nft_transfers_csv,
+                prefetch_depth=prefetch_depth,
+                shards=shards,
+                date_block_mapping_file=date_block_mapping_csv,
+                checkpoint=checkpoint,
             )
+        checkpoint.mark_done("transfers")
 
-        # Update date block mapping
-        update_block_to_date_mapping(
-            filename=date_block_mapping_csv, eth_service=eth_service
+    def fetch_sales():
+        if checkpoint.is_done("sales"):
+            return
+        # Export sales
+        get_nft_sales(
+            start_block=start_block,
+            end_block=end_block,
+            api_key=alchemy_api_key,
+            contract_address=contract_address,
+            output=nft_sales_csv,
+            prefetch_depth=prefetch_depth,
+            shards=shards,
+            date_block_mapping_file=date_block_mapping_csv,
+            checkpoint=checkpoint,
         )
+        checkpoint.mark_done("sales")
 
-        # Update ETH prices
-        update_eth_prices(filename=eth_prices_csv)
+    def consolidate():
+        if checkpoint.is_done("consolidate"):
+            return
+        # The date index is built by a stage of the graph when none was passed in
+        index = date_index if date_index is not None else graph.results["date_index"]
 
         # Generate sales output
         generate_sales_output(
-            sales_file=nft_sales_csv.name,
+            sales_file=nft_sales_csv,
             date_block_mapping_file=date_block_mapping_csv,
             eth_prices_file=eth_prices_csv,
             output=sales_csv,
+            date_index=index,
+            hour_block_mapping_file=hour_block_mapping_csv,
+            hourly_eth_prices_file=hourly_eth_prices_csv,
+            timestamp_index=timestamp_index,
+            chunksize=output_chunksize,
         )
 
         # Generate transfers output
         generate_transfers_output(
-            transfers_file=nft_transfers_csv.name,
+            transfers_file=nft_transfers_csv,
             date_block_mapping_file=date_block_mapping_csv,
             output=transfers_csv,
+            date_index=index,
+            timestamp_index=timestamp_index,
+            chunksize=output_chunksize,
         )
 
         # Consolidate sales and transfers data into final outputs
-        clean_up_outputs()
+        clean_up_outputs(
+            contract_address=contract_address,
+            from_block=start_block,
+            storage_format=storage_format,
+            chunksize=output_chunksize,
+        )
+        checkpoint.mark_done("consolidate")
+
+    timestamp_index = None
+    if timestamp_service is not None:
+        timestamp_index = timestamp_service.timestamp_index
 
+    def fill_block_timestamps():
+        if checkpoint.is_done("consolidate"):
+            return
+        # Fetch the blocks of this run that the block timestamp index does not know yet
+        block_numbers = pd.concat(
+            [
+                read_table(nft_transfers_csv, columns=["block_number"]),
+                read_table(nft_sales_csv, columns=["block_number"]),
+            ]
+        )["block_number"]
+        num_fetched = timestamp_service.fill_block_timestamps(block_numbers)
+        print("Fetched timestamps of {} blocks".format(num_fetched))
+
+    def extract_token_ids():
         # Re-generate list of token IDs from consolidated data set
         extract_unique_column_value(
-            input_filename=all_transfers_csv,
-            output_filename=all_token_ids_txt.name,
+            input_filename=all_transfers_data,
+            output_filename=all_token_ids_txt,
             column="asset_id",
         )
+        with open(all_token_ids_txt) as f:
+            return [line.strip() for line in f if line.strip()]
 
-        # Fetch metadata
-        get_metadata_for_collection(
-            api_key=alchemy_api_key,
-            contract_address=contract_address,
-            output=raw_attributes_csv.name,
-        )
+    # Fetch metadata into the persisted metadata store
+    metadata_store = MetadataStore(contract_address)
+
+    def fetch_metadata():
+        if checkpoint.is_done("metadata"):
+            return
+        all_token_ids = graph.results[prefix + "token_ids"]
+        if metadata_refresh == "full" or metadata_store.needs_full_sweep(
+            full_sweep_days
+        ):
+            get_metadata_for_collection(
+                api_key=alchemy_api_key,
+                contract_address=contract_address,
+                output=raw_attributes_csv,
+                prefetch_depth=prefetch_depth,
+                concurrency=metadata_concurrency,
+                token_ids_file=all_token_ids_txt,
+            )
+            changed = metadata_store.update(
+                raw_attributes_csv, all_token_ids, full_sweep=True
+            )
+        else:
+            # Only fetch tokens that are not in the store yet, i.e. tokens first
+            # seen in this run's transfers
+            known_token_ids = metadata_store.known_token_ids()
+            new_token_ids = [t for t in all_token_ids if t not in known_token_ids]
+            get_metadata_for_tokens(
+                api_key=alchemy_api_key,
+                contract_address=contract_address,
+                token_ids=new_token_ids,
+                output=raw_attributes_csv,
+            )
+            changed = metadata_store.update(raw_attributes_csv, new_token_ids)
+        print("Metadata changed for {} tokens".format(changed))
+        checkpoint.mark_done("metadata")
 
-        # Generate metadata output
+    def write_metadata_output():
+        # Generate metadata output from the stored attributes
         generate_metadata_output(
-            raw_attributes_file=raw_attributes_csv.name,
-            token_ids_file=all_token_ids_txt.name,
-            output=metadata_csv,
+            raw_attributes_file=metadata_store.attributes_file,
+            token_ids_file=all_token_ids_txt,
+            output=metadata_data,
+            rarity_models=rarity_models,
         )
 
+        # Render the stored metadata to the CSV output
+        if storage_format == "parquet":
+            read_table(metadata_data).to_csv(metadata_csv, index=False)
+
+    def finish():
         # Export to update log file
         export_update_logs(
             update_log_file=updates_csv,
             current_block_number=end_block,
         )
 
+        # The run is complete; drop its checkpoint and intermediate files
+        checkpoint.clear()
+
         print("Data exported to transfers.csv, sales.csv and metadata.csv")
 
+    # Transfers and sales are fetched concurrently; everything after them depends on
+    # both. Stages of a graph passed in by the caller are prefixed with the contract.
+    owns_graph = graph is None
+    if owns_graph:
+        graph = StageGraph()
+        prefix = ""
+    else:
+        prefix = contract_address + ":"
+    graph.add(prefix + "transfers", fetch_transfers, depends_on=fetch_after)
+    graph.add(prefix + "sales", fetch_sales, depends_on=fetch_after)
+    consolidate_after = [prefix + "transfers", prefix + "sales", *consolidate_after]
+    if timestamp_service is not None:
+        graph.add(
+            prefix + "block_timestamps",
+            fill_block_timestamps,
+            depends_on=[prefix + "transfers", prefix + "sales"],
+        )
+        consolidate_after.append(prefix + "block_timestamps")
+    graph.add(prefix + "consolidate", consolidate, depends_on=consolidate_after)
+    graph.add(
+        prefix + "token_ids", extract_token_ids, depends_on=[prefix + "consolidate"]
+    )
+    graph.add(prefix + "metadata", fetch_metadata, depends_on=[prefix + "token_ids"])
+    graph.add(
+        prefix + "metadata_output",
+        write_metadata_output,
+        depends_on=[prefix + "metadata"],
+    )
+    graph.add(prefix + "update_logs", finish, depends_on=[prefix + "metadata_output"])
+
+    # The caller runs a graph it passed in, together with its own stages
+    if not owns_graph:
+        return
+
+    with quiet():
+        graph.run()
+    print(graph.timing_summary())
+
 
 if __name__ == "__main__":
     export_data()
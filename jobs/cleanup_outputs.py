@@ -1,68 +1,161 @@
+import csv
+import glob
 import os
+import shutil
 
 import pandas as pd
 
+from utils.storage import (
+    add_to_dataset,
+    drop_from_dataset,
+    render_dataset_to_csv,
+    seed_dataset_from_csv,
+)
 
-def clean_up_outputs():
-    # Find all csv files and organize by data type, contract, and run date
-    csv_files = [f for f in os.listdir(".") if f.endswith(".csv")]
+# Rows read at a time from run files and consolidated outputs that are streamed
+CHUNKSIZE = 100000
 
-    filetypes = []
-    contracts = []
-    run_dates = []
 
-    for c in csv_files:
-        filetypes.append(c.split("_")[0].split(".")[0])
-        contracts.append(c.split("_")[1].split(".")[0])
+def clean_up_outputs(
+    contract_address, from_block=None, storage_format="csv", chunksize=None
+):
+    # Consolidate this contract's new sales and transfers run files into the final output CSVs
+    if chunksize is None:
+        chunksize = CHUNKSIZE
 
-        try:
-            run_dates.append(c.split("_")[2].split(".")[0])
-        except:
-            run_dates.append("N/A")
+    for filetype in ("sales", "transfers"):
+        run_files = sorted(glob.glob(filetype + "_" + contract_address + "_*.csv"))
+        if len(run_files) == 0:
+            continue
 
-    df = pd.DataFrame(
-        {
-            "filetype": filetypes,
-            "contract": contracts,
-            "run_date": run_dates,
-            "file": csv_files,
-        }
-    )
+        consolidated_file = filetype + "_" + contract_address + ".csv"
 
-    # Get unique contracts with existing sales or transfer data
-    unique_contracts = df[
-        (df["filetype"] == "sales") | (df["filetype"] == "transfers")
-    ]["contract"].unique()
+        if storage_format == "parquet":
+            # Store the delta in the partitioned Parquet dataset, then render the CSV from it.
+            # The CSV history of a collection switching to Parquet is stored first. Both
+            # are streamed into the dataset chunksize rows at a time.
+            seed_dataset_from_csv(
+                kind=filetype,
+                contract_address=contract_address,
+                csv_file=consolidated_file,
+                chunksize=chunksize,
+            )
+            if from_block is None:
+                from_block = min_block_number(run_files, chunksize)
+            if from_block is not None:
+                drop_from_dataset(
+                    kind=filetype,
+                    contract_address=contract_address,
+                    from_block=from_block,
+                )
+            for f in run_files:
+                with pd.read_csv(f, chunksize=chunksize) as reader:
+                    for chunk in reader:
+                        add_to_dataset(
+                            chunk, kind=filetype, contract_address=contract_address
+                        )
+            render_dataset_to_csv(
+                kind=filetype,
+                contract_address=contract_address,
+                output=consolidated_file,
+                columns=pd.read_csv(run_files[0], nrows=0).columns,
+            )
+        else:
+            merge_into_consolidated_output(
+                run_files=run_files,
+                consolidated_file=consolidated_file,
+                from_block=from_block,
+                chunksize=chunksize,
+            )
 
-    # Consolidate sales and transfers data into final output CSVs
-    for uc in unique_contracts:
-        clean_sales_csv = "sales_" + uc + ".csv"
-        clean_transfers_csv = "transfers_" + uc + ".csv"
+        # Remove historical files
+        for f in run_files:
+            os.remove(f)
+
+
+def min_block_number(run_files, chunksize):
+    # Lowest block number of the run files, read one chunk of the column at a time
+    minimums = []
+    for f in run_files:
+        with pd.read_csv(f, usecols=["block_number"], chunksize=chunksize) as reader:
+            minimums += [chunk["block_number"].min() for chunk in reader]
+    minimums = [m for m in minimums if pd.notna(m)]
+    return min(minimums) if len(minimums) > 0 else None
+
+
+def merge_into_consolidated_output(
+    run_files, consolidated_file, from_block=None, chunksize=CHUNKSIZE
+):
+    # New rows are always at or above the previous run's last block, and the consolidated
+    # file is sorted by descending block number. The delta therefore replaces the rows at
+    # the top of the file from from_block upwards, and the rest of the file is copied
+    # through unparsed, so only the delta is ever loaded into memory.
+    if len(run_files) == 1 and not os.path.isfile(consolidated_file):
+        # A first export's single run file is already sorted by the output generators,
+        # so it becomes the consolidated file without being loaded (it may be too large
+        # to fit in memory)
+        shutil.copyfile(run_files[0], consolidated_file)
+        return
+
+    delta_df = pd.concat([pd.read_csv(f) for f in run_files], ignore_index=True)
+    delta_df = delta_df.sort_values(by=["block_number"], ascending=False, kind="stable")
 
-        sales_df = pd.DataFrame()
-        transfers_df = pd.DataFrame()
+    if from_block is None and not delta_df.empty:
+        from_block = delta_df["block_number"].min()
 
-        transfer_files = df[(df["contract"] == uc) & (df["filetype"] == "transfers")][
-            "file"
+    if not os.path.isfile(consolidated_file):
+        delta_df.to_csv(consolidated_file, index=False)
+        return
+
+    with open(consolidated_file, "r", newline="") as existing_file:
+        header = next(csv.reader([existing_file.readline()]), [])
+
+    merged_file = consolidated_file + ".tmp"
+
+    if sorted(header) != sorted(delta_df.columns):
+        # Column layout changed between runs: the existing rows below from_block are
+        # rewritten chunksize rows at a time with the columns of both layouts, empty
+        # where a row's layout lacks one. Values are read as text to pass through as is.
+        columns = list(delta_df.columns) + [
+            c for c in header if c not in delta_df.columns
         ]
-        sales_files = df[(df["contract"] == uc) & (df["filetype"] == "sales")]["file"]
+        with open(merged_file, "w", newline="") as output_file, pd.read_csv(
+            consolidated_file, dtype=str, keep_default_na=False, chunksize=chunksize
+        ) as reader:
+            delta_df.reindex(columns=columns).to_csv(output_file, index=False)
+            for chunk in reader:
+                if from_block is not None:
+                    block_numbers = pd.to_numeric(
+                        chunk["block_number"], errors="coerce"
+                    )
+                    chunk = chunk[block_numbers < from_block]
+                chunk.reindex(columns=columns).to_csv(
+                    output_file, header=False, index=False
+                )
+        os.replace(merged_file, consolidated_file)
+        return
 
-        for t in transfer_files:
-            transfers_df = pd.concat([transfers_df, pd.read_csv(t)])
+    block_number_index = header.index("block_number")
 
-        for s in sales_files:
-            sales_df = pd.concat([sales_df, pd.read_csv(s)])
+    with open(consolidated_file, "r", newline="") as existing_file, open(
+        merged_file, "w", newline=""
+    ) as output_file:
+        existing_file.readline()
+        delta_df[header].to_csv(output_file, index=False)
 
-        # Remove historical files
-        for s in sales_files:
-            os.remove(s)
-        for t in transfer_files:
-            os.remove(t)
-
-        # Export to final output csv files
-        transfers_df.sort_values(by=["block_number"], ascending=False).to_csv(
-            clean_transfers_csv, index=False
-        )
-        sales_df.sort_values(by=["block_number"], ascending=False).to_csv(
-            clean_sales_csv, index=False
-        )
+        # Skip existing rows superseded by the delta, then copy the remainder verbatim
+        while True:
+            position = existing_file.tell()
+            line = existing_file.readline()
+            if line == "":
+                break
+
+            row = next(csv.reader([line]), [])
+            if len(row) == 0:
+                continue
+            if from_block is None or float(row[block_number_index]) < from_block:
+                existing_file.seek(position)
+                shutil.copyfileobj(existing_file, output_file)
+                break
+
+    os.replace(merged_file, consolidated_file)
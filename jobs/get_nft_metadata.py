@@ -1,20 +1,154 @@
-from time import sleep
+import csv
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
-import requests
+from utils.http_client import alchemy_client
+from utils.paginate import fetch_with_retries, paginate
+from utils.rate_limiter import ALCHEMY_COMPUTE_UNITS
 
+# Tokens passed to getNFTMetadataBatch in a single request
+MAX_TOKENS_PER_METADATA_BATCH = 100
 
-def get_metadata_for_collection(api_key, contract_address, output):
-    # Method for fetching metadata using Alchemy's getNFTsForCollection endpoint
+ATTRIBUTE_COLUMNS = ["value", "trait_type", "asset_id"]
+
+
+def get_next_start_token(j):
+    try:
+        return int(j["nextToken"], 16)
+    except:
+        return None
+
+
+def decode_attributes(nfts):
+    # Decode the attributes of each NFT into rows ordered like ATTRIBUTE_COLUMNS
+    rows = []
+    for nft in nfts:
+        try:
+            attributes_raw = nft["metadata"]["attributes"]
+            asset_id = int(nft["id"]["tokenId"], 16)
+
+            # Skip tokens whose attributes have no values or no trait types at all
+            if not any("value" in a for a in attributes_raw) or not any(
+                "trait_type" in a for a in attributes_raw
+            ):
+                continue
+
+            rows.extend(
+                [
+                    (a.get("value"), a.get("trait_type"), asset_id)
+                    for a in attributes_raw
+                ]
+            )
+
+        except:
+            continue
+
+    return rows
+
+
+def split_token_ranges(token_ids, num_partitions):
+    # Split the collection into up to num_partitions token ID ranges holding equal numbers
+    # of known tokens. Ranges are (start_token, end_token) with end_token excluded; the
+    # first range starts at the beginning of the collection and the last one is unbounded.
+    token_ids = sorted(set(int(t) for t in token_ids))
+    num_partitions = max(1, min(num_partitions, len(token_ids)))
+    boundaries = sorted(
+        set(
+            token_ids[len(token_ids) * i // num_partitions]
+            for i in range(1, num_partitions)
+        )
+    )
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+
+def get_metadata_for_collection(
+    api_key,
+    contract_address,
+    output,
+    prefetch_depth=2,
+    concurrency=1,
+    token_ids_file=None,
+):
+    # Method for fetching metadata using Alchemy's getNFTsForCollection endpoint.
+    # With a concurrency level above 1, the token IDs listed in token_ids_file are used to
+    # split the collection into startToken ranges that are fetched concurrently.
     print("Fetching NFT metadata...")
 
-    raw_attributes = pd.DataFrame(columns=["value", "trait_type", "asset_id"])
-    start_token = None
-    process_active = True
+    token_ranges = [(None, None)]
+    if concurrency > 1 and token_ids_file is not None:
+        with open(token_ids_file) as f:
+            token_ranges = split_token_ranges(
+                [line.strip() for line in f if line.strip()], concurrency
+            )
+
+    if len(token_ranges) == 1:
+        get_metadata_for_token_range(
+            api_key, contract_address, output, prefetch_depth=prefetch_depth
+        )
+        return
+
+    print("Fetching metadata in {} token ranges...".format(len(token_ranges)))
+
+    with tempfile.TemporaryDirectory() as range_dir:
+        range_outputs = [
+            os.path.join(range_dir, "range_{}.csv".format(i))
+            for i in range(len(token_ranges))
+        ]
+
+        # Every range shares the Alchemy rate limiter through alchemy_client
+        with ThreadPoolExecutor(max_workers=len(token_ranges)) as executor:
+            futures = [
+                executor.submit(
+                    get_metadata_for_token_range,
+                    api_key,
+                    contract_address,
+                    range_output,
+                    start_token=start_token,
+                    end_token=end_token,
+                    prefetch_depth=prefetch_depth,
+                )
+                for (start_token, end_token), range_output in zip(
+                    token_ranges, range_outputs
+                )
+            ]
+            for future in futures:
+                future.result()
 
-    # Loop through collection using pagination tokens until complete
-    while process_active:
-        if not start_token:
+        # Stitch the ranges together in token order. A token is only kept from the
+        # first range that returned it.
+        with open(output, "w", newline="") as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(ATTRIBUTE_COLUMNS)
+
+            seen_asset_ids = set()
+            for range_output in range_outputs:
+                range_asset_ids = set()
+                with open(range_output, "r", newline="") as range_file:
+                    reader = csv.reader(range_file)
+                    next(reader)
+                    for row in reader:
+                        if row[2] in seen_asset_ids:
+                            continue
+                        range_asset_ids.add(row[2])
+                        writer.writerow(row)
+                seen_asset_ids |= range_asset_ids
+
+
+def get_metadata_for_token_range(
+    api_key,
+    contract_address,
+    output,
+    start_token=None,
+    end_token=None,
+    prefetch_depth=2,
+):
+    # Fetch the metadata of tokens from start_token up to (excluding) end_token
+    def fetch_page(cursor):
+        if cursor is None:
+            cursor = start_token
+
+        if not cursor:
             alchemy_url = "https://eth-mainnet.g.alchemy.com/v2/{api_key}/getNFTsForCollection?contractAddress={contract_address}&withMetadata=true&refreshCache=true".format(
                 api_key=api_key,
                 contract_address=contract_address,
@@ -23,48 +157,102 @@ def get_metadata_for_collection(api_key, contract_address, output):
             alchemy_url = "https://eth-mainnet.g.alchemy.com/v2/{api_key}/getNFTsForCollection?contractAddress={contract_address}&withMetadata=true&refreshCache=true&startToken={start_token}".format(
                 api_key=api_key,
                 contract_address=contract_address,
-                start_token=start_token,
+                start_token=cursor,
             )
 
         headers = {
             "Accept": "application/json",
         }
 
-        # Sometimes requests can randomly fail. Retry 3 times before timing out.
-        retries = 3
-        for i in range(retries):
-            try:
-                r = requests.get(alchemy_url, headers=headers)
+        def fetch():
+            r = alchemy_client.get(
+                alchemy_url,
+                headers=headers,
+                cost=ALCHEMY_COMPUTE_UNITS["getNFTsForCollection"],
+            )
+            j = r.json()
+            j["nfts"]
+            return j
+
+        return fetch_with_retries(fetch)
+
+    def get_next_cursor(j):
+        # Stop once the next page starts in the following range
+        next_token = get_next_start_token(j)
+        if next_token is not None and end_token is not None and next_token >= end_token:
+            return None
+        return next_token
+
+    def in_range(row):
+        asset_id = row[2]
+        return (start_token is None or asset_id >= start_token) and (
+            end_token is None or asset_id < end_token
+        )
+
+    if start_token is None and end_token is None:
+        label = "Metadata"
+    else:
+        label = "Metadata tokens {} to {}".format(
+            start_token if start_token is not None else "start",
+            end_token - 1 if end_token is not None else "end",
+        )
+
+    # Loop through the range using pagination tokens until complete, streaming
+    # each page's attributes to the CSV file
+    with open(output, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(ATTRIBUTE_COLUMNS)
+
+        for j in paginate(
+            fetch_page,
+            get_next_cursor,
+            prefetch_depth=prefetch_depth,
+            label=label,
+        ):
+            writer.writerows(filter(in_range, decode_attributes(j["nfts"])))
+
+
+def get_metadata_for_tokens(api_key, contract_address, token_ids, output):
+    # Method for fetching metadata of specific tokens using Alchemy's getNFTMetadataBatch endpoint.
+    # Cached metadata is accepted, since only tokens never fetched before are requested.
+    print("Fetching NFT metadata for {} tokens...".format(len(token_ids)))
+
+    alchemy_url = (
+        "https://eth-mainnet.g.alchemy.com/nft/v2/{api_key}/getNFTMetadataBatch".format(
+            api_key=api_key
+        )
+    )
+
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+
+    token_ids = list(token_ids)
+    with open(output, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(ATTRIBUTE_COLUMNS)
+
+        for i in range(0, len(token_ids), MAX_TOKENS_PER_METADATA_BATCH):
+            payload = {
+                "tokens": [
+                    {"contractAddress": contract_address, "tokenId": str(token_id)}
+                    for token_id in token_ids[i : i + MAX_TOKENS_PER_METADATA_BATCH]
+                ],
+                "refreshCache": False,
+            }
+
+            def fetch():
+                r = alchemy_client.post(
+                    alchemy_url,
+                    json=payload,
+                    headers=headers,
+                    cost=ALCHEMY_COMPUTE_UNITS["getNFTMetadataBatch"],
+                )
                 j = r.json()
+                # Errors are returned as an object instead of a list of NFTs
+                if not isinstance(j, list):
+                    raise KeyError("nfts")
+                return j
 
-                nft_list = j["nfts"]
-                for nft in nft_list:
-                    try:
-                        attributes_raw = nft["metadata"]["attributes"]
-                        attributes_df = pd.DataFrame(attributes_raw)
-                        attributes_df["asset_id"] = int(nft["id"]["tokenId"], 16)
-                        attributes_df = attributes_df[
-                            ["value", "trait_type", "asset_id"]
-                        ]
-                        raw_attributes = pd.concat(
-                            [raw_attributes, attributes_df], ignore_index=True
-                        )
-
-                    except:
-                        continue
-
-                try:
-                    start_token = int(j["nextToken"], 16)
-                except:
-                    process_active = False
-            except KeyError:
-                if i < retries - 1:
-                    print("Alchemy request failed. Retrying request...")
-                    sleep(5)
-                    continue
-                else:
-                    raise
-            break
-
-    # Output attributes data to CSV file
-    raw_attributes.to_csv(output, index=False)
+            writer.writerows(decode_attributes(fetch_with_retries(fetch)))
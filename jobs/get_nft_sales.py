@@ -1,34 +1,173 @@
-from time import sleep
-
+import numpy as np
 import pandas as pd
-import requests
 
+from utils.block_ranges import fetch_block_range_in_shards
+from utils.checkpoint import PageCheckpoint
+from utils.http_client import alchemy_client
+from utils.paginate import fetch_with_retries, paginate
+from utils.rate_limiter import ALCHEMY_COMPUTE_UNITS
+
+SALE_COLUMNS = [
+    "transaction_hash",
+    "block_number",
+    "asset_id",
+    "marketplace",
+    "seller",
+    "buyer",
+    "maker",
+    "taker",
+    "seller_fee",
+    "protocol_fee",
+    "royalty_fee",
+    "quantity",
+]
+
+# Trade currency must be ETH, WETH, or Blur Pool Token
+ETH_CURRENCIES = (
+    "0x0000000000000000000000000000000000000000",
+    "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
+    "0x0000000000a39bb272e79075ade125fd351887ac",
+)
+
+ETH_DECIMALS = 18
+
+
+def convert_fees_to_eth(fees):
+    # Convert a page of raw fee objects into exact ETH decimal strings in one pass.
+    # Fees in other currencies, or with missing or malformed amounts, are set to 0.
+    fees = pd.Series(fees, dtype=object)
+    token_addresses = fees.map(
+        lambda fee: fee.get("tokenAddress") if isinstance(fee, dict) else None
+    )
+    amounts = fees.map(
+        lambda fee: str(fee.get("amount")) if isinstance(fee, dict) else ""
+    )
 
-def get_nft_sales(start_block, end_block, api_key, contract_address, output):
-    # Method for fetching NFT sales using Alchemy's getNFTSales endpoint
-    print("Fetching NFT sales...")
+    is_eth = token_addresses.isin(ETH_CURRENCIES) & amounts.str.fullmatch(r"\d+")
+
+    # Shift the decimal point of the wei amount by 18 places using string operations,
+    # which keeps the conversion exact where float division would round
+    wei = amounts[is_eth].str.zfill(ETH_DECIMALS + 1)
+    integer_part = wei.str[:-ETH_DECIMALS].str.lstrip("0").replace("", "0")
+    fractional_part = wei.str[-ETH_DECIMALS:].str.rstrip("0")
+    eth = integer_part.where(
+        fractional_part == "", integer_part + "." + fractional_part
+    )
+
+    eth_fees = pd.Series("0", index=fees.index, dtype=object)
+    eth_fees[is_eth] = eth
+    return eth_fees
+
+
+def decode_sales(sales):
+    # Collect the raw fields of a page of Alchemy sales into column arrays
+    columns = {
+        "transaction_hash": [],
+        "block_number": [],
+        "asset_id": [],
+        "marketplace": [],
+        "seller": [],
+        "buyer": [],
+        "taker_side": [],
+        "seller_fee": [],
+        "protocol_fee": [],
+        "royalty_fee": [],
+        "quantity": [],
+    }
+    for sale in sales:
+        try:
+            row = (
+                sale["transactionHash"],
+                sale["blockNumber"],
+                sale["tokenId"],
+                sale["marketplace"],
+                sale["sellerAddress"],
+                sale["buyerAddress"],
+                sale["taker"],
+                sale.get("sellerFee"),
+                sale.get("protocolFee"),
+                sale.get("royaltyFee"),
+                sale["quantity"],
+            )
+        except:
+            continue
+
+        for column, value in zip(columns.values(), row):
+            column.append(value)
 
     nft_sales = pd.DataFrame(
-        columns=[
-            "transaction_hash",
-            "block_number",
-            "asset_id",
-            "marketplace",
-            "seller",
-            "buyer",
-            "maker",
-            "taker",
-            "seller_fee",
-            "protocol_fee",
-            "royalty_fee",
-            "quantity",
-        ]
+        {
+            column: values
+            for column, values in columns.items()
+            if column not in ("seller_fee", "protocol_fee", "royalty_fee")
+        }
     )
-    page_key = None
-    process_active = True
 
-    # Loop through collection using pagination tokens until complete
-    while process_active:
+    # Assign maker and taker based on which side of the trade took the order
+    taker_is_buyer = nft_sales["taker_side"] == "BUYER"
+    nft_sales["maker"] = np.where(
+        taker_is_buyer, nft_sales["seller"], nft_sales["buyer"]
+    )
+    nft_sales["taker"] = np.where(
+        taker_is_buyer, nft_sales["buyer"], nft_sales["seller"]
+    )
+
+    # Convert fees from wei to ETH
+    for fee_column in ("seller_fee", "protocol_fee", "royalty_fee"):
+        nft_sales[fee_column] = convert_fees_to_eth(columns[fee_column])
+
+    return nft_sales[SALE_COLUMNS]
+
+
+def get_nft_sales(
+    start_block,
+    end_block,
+    api_key,
+    contract_address,
+    output,
+    prefetch_depth=2,
+    shards=1,
+    date_block_mapping_file=None,
+    checkpoint=None,
+):
+    # Method for fetching NFT sales using Alchemy's getNFTSales endpoint.
+    # With a run checkpoint, pages committed by an interrupted run are not fetched again.
+    print("Fetching NFT sales...")
+
+    # Split the block range into shards that are fetched concurrently
+    def fetch_range(range_start_block, range_end_block, range_output):
+        get_nft_sales_for_block_range(
+            start_block=range_start_block,
+            end_block=range_end_block,
+            api_key=api_key,
+            contract_address=contract_address,
+            output=range_output,
+            prefetch_depth=prefetch_depth,
+            checkpoint=checkpoint,
+        )
+
+    fetch_block_range_in_shards(
+        fetch_range,
+        start_block=start_block,
+        end_block=end_block,
+        output=output,
+        shards=shards,
+        sort_columns=["block_number"],
+        date_block_mapping_file=date_block_mapping_file,
+        shard_dir=checkpoint.path("sales_shards") if checkpoint else None,
+    )
+
+
+def get_nft_sales_for_block_range(
+    start_block,
+    end_block,
+    api_key,
+    contract_address,
+    output,
+    prefetch_depth=2,
+    checkpoint=None,
+):
+    def fetch_page(page_key):
         if not page_key:
             alchemy_url = "https://eth-mainnet.g.alchemy.com/nft/v2/{api_key}/getNFTSales?fromBlock={start_block}&toBlock={end_block}&order=asc&contractAddress={contract_address}".format(
                 api_key=api_key,
@@ -49,128 +188,40 @@ def get_nft_sales(start_block, end_block, api_key, contract_address, output):
             "Accept": "application/json",
         }
 
-        # Sometimes requests can randomly fail. Retry 3 times before timing out.
-        retries = 3
-        for i in range(retries):
-            try:
-                r = requests.get(alchemy_url, headers=headers)
-                j = r.json()
-
-                sales = j["nftSales"]
-                for sale in sales:
-                    try:
-                        nft_sales_df = pd.DataFrame(
-                            columns=[
-                                "transaction_hash",
-                                "block_number",
-                                "asset_id",
-                                "marketplace",
-                                "seller",
-                                "buyer",
-                                "maker",
-                                "taker",
-                                "seller_fee",
-                                "protocol_fee",
-                                "royalty_fee",
-                                "quantity",
-                            ]
-                        )
-
-                        transaction_hash = sale["transactionHash"]
-                        block_number = sale["blockNumber"]
-                        asset_id = sale["tokenId"]
-                        marketplace = sale["marketplace"]
-                        seller = sale["sellerAddress"]
-                        buyer = sale["buyerAddress"]
-                        if sale["taker"] == "BUYER":
-                            taker = sale["buyerAddress"]
-                            maker = sale["sellerAddress"]
-                        else:
-                            taker = sale["sellerAddress"]
-                            maker = sale["buyerAddress"]
-
-                        try:
-                            # Trade currency must be ETH, WETH, or Blur Pool Token
-                            if sale["sellerFee"]["tokenAddress"] in (
-                                "0x0000000000000000000000000000000000000000",
-                                "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
-                                "0x0000000000a39bb272e79075ade125fd351887ac",
-                            ):
-                                seller_fee = (
-                                    float(sale["sellerFee"]["amount"]) / 10**18
-                                )
-                            else:
-                                seller_fee = 0
-                        except:
-                            seller_fee = 0
-
-                        try:
-                            # Trade currency must be ETH, WETH, or Blur Pool Token
-                            if sale["protocolFee"]["tokenAddress"] in (
-                                "0x0000000000000000000000000000000000000000",
-                                "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
-                                "0x0000000000a39bb272e79075ade125fd351887ac",
-                            ):
-                                protocol_fee = (
-                                    float(sale["protocolFee"]["amount"]) / 10**18
-                                )
-                            else:
-                                protocol_fee = 0
-                        except:
-                            protocol_fee = 0
-
-                        try:
-                            # Trade currency must be ETH, WETH, or Blur Pool Token
-                            if sale["royaltyFee"]["tokenAddress"] in (
-                                "0x0000000000000000000000000000000000000000",
-                                "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2",
-                                "0x0000000000a39bb272e79075ade125fd351887ac",
-                            ):
-                                royalty_fee = (
-                                    float(sale["royaltyFee"]["amount"]) / 10**18
-                                )
-                            else:
-                                royalty_fee = 0
-                        except:
-                            royalty_fee = 0
-
-                        quantity = sale["quantity"]
-
-                        nft_sales_dict = {
-                            "transaction_hash": [transaction_hash],
-                            "block_number": [block_number],
-                            "asset_id": [asset_id],
-                            "marketplace": [marketplace],
-                            "seller": [seller],
-                            "buyer": [buyer],
-                            "maker": [maker],
-                            "taker": [taker],
-                            "seller_fee": [seller_fee],
-                            "protocol_fee": [protocol_fee],
-                            "royalty_fee": [royalty_fee],
-                            "quantity": [quantity],
-                        }
-
-                        nft_sales_df = pd.DataFrame(nft_sales_dict)
-                        nft_sales = pd.concat(
-                            [nft_sales, nft_sales_df], ignore_index=True
-                        )
-
-                    except:
-                        continue
-
-                try:
-                    page_key = j["pageKey"]
-                except:
-                    process_active = False
-            except KeyError:
-                if i < retries - 1:
-                    print("Alchemy request failed. Retrying request...")
-                    sleep(5)
-                    continue
-                else:
-                    raise
-            break
-
-    # Output attributes data to CSV file
-    nft_sales.to_csv(output, index=False)
+        def fetch():
+            r = alchemy_client.get(
+                alchemy_url, headers=headers, cost=ALCHEMY_COMPUTE_UNITS["getNFTSales"]
+            )
+            j = r.json()
+            j["nftSales"]
+            return j
+
+        return fetch_with_retries(fetch)
+
+    label = "Sales {}-{}".format(start_block, end_block)
+    if checkpoint is None:
+        page_checkpoint = PageCheckpoint()
+    else:
+        page_checkpoint = checkpoint.job(
+            output, start_block=start_block, end_block=end_block
+        )
+        if page_checkpoint.done:
+            return
+        if page_checkpoint.resumed:
+            label += " (resumed)"
+
+    # Sales are appended to the output file page by page
+    with page_checkpoint.open_output(output) as output_file:
+        if output_file.tell() == 0:
+            pd.DataFrame(columns=SALE_COLUMNS).to_csv(output_file, index=False)
+
+        # Loop through collection using pagination tokens until complete
+        for j in paginate(
+            fetch_page,
+            lambda j: j.get("pageKey"),
+            prefetch_depth=prefetch_depth,
+            label=label,
+            start_cursor=page_checkpoint.cursor,
+        ):
+            decode_sales(j["nftSales"]).to_csv(output_file, header=False, index=False)
+            page_checkpoint.commit(j.get("pageKey"))
@@ -1,137 +1,221 @@
-from time import sleep
+import contextlib
+import csv
+
+from utils.block_ranges import fetch_block_range_in_shards
+from utils.checkpoint import PageCheckpoint
+from utils.http_client import alchemy_client
+from utils.paginate import fetch_with_retries, paginate
+from utils.rate_limiter import ALCHEMY_COMPUTE_UNITS
+
+# Contracts passed to alchemy_getAssetTransfers in a single request
+MAX_CONTRACT_ADDRESSES_PER_REQUEST = 100
+
+TRANSFER_COLUMNS = [
+    "transaction_hash",
+    "block_number",
+    "asset_id",
+    "from_address",
+    "to_address",
+    "value",
+    "log_index",
+]
+
+
+def decode_transfers(transfers):
+    # Decode a page of raw Alchemy transfers into rows ordered like TRANSFER_COLUMNS
+    rows = []
+    for transfer in transfers:
+        try:
+            transaction_hash = transfer["hash"]
+            block_number = int(transfer["blockNum"], 16)
+
+            if transfer["category"] == "erc1155":
+                asset_id = int(transfer["erc1155Metadata"][0]["tokenId"], 16)
+                value = int(transfer["erc1155Metadata"][0]["value"], 16)
+            else:
+                asset_id = int(transfer["erc721TokenId"], 16)
+                value = 1
+
+            from_address = transfer["from"]
+            to_address = transfer["to"]
+            log_index_substr = len(transfer["uniqueId"]) - 71
+            log_index = transfer["uniqueId"][-log_index_substr:]
+
+            rows.append(
+                (
+                    transaction_hash,
+                    block_number,
+                    asset_id,
+                    from_address,
+                    to_address,
+                    value,
+                    log_index,
+                )
+            )
 
-import pandas as pd
-import requests
+        except:
+            continue
+
+    return rows
+
+
+def get_nft_transfers(
+    start_block,
+    end_block,
+    api_key,
+    contract_address,
+    output,
+    prefetch_depth=2,
+    shards=1,
+    date_block_mapping_file=None,
+    checkpoint=None,
+):
+    # Method for fetching NFT transfers using Alchemy's alchemy_getAssetTransfers endpoint.
+    # With a run checkpoint, pages committed by an interrupted run are not fetched again.
+    print("Fetching NFT transfers...")
 
+    # Split the block range into shards that are fetched concurrently
+    def fetch_range(range_start_block, range_end_block, range_output):
+        get_nft_transfers_for_block_range(
+            start_block=range_start_block,
+            end_block=range_end_block,
+            api_key=api_key,
+            contract_address=contract_address,
+            output=range_output,
+            prefetch_depth=prefetch_depth,
+            checkpoint=checkpoint,
+        )
+
+    fetch_block_range_in_shards(
+        fetch_range,
+        start_block=start_block,
+        end_block=end_block,
+        output=output,
+        shards=shards,
+        sort_columns=["block_number", "log_index"],
+        date_block_mapping_file=date_block_mapping_file,
+        shard_dir=checkpoint.path("transfers_shards") if checkpoint else None,
+    )
 
-def get_nft_transfers(start_block, end_block, api_key, contract_address, output):
-    # Method for fetching NFT transfers using Alchemy's alchemy_getAssetTransfers endpoint
-    print("Fetching NFT transfers...")
 
-    nft_transfers = pd.DataFrame(
-        columns=[
-            "transaction_hash",
-            "block_number",
-            "asset_id",
-            "from_address",
-            "to_address",
-            "value",
-            "log_index",
-        ]
+def get_nft_transfers_for_block_range(
+    start_block,
+    end_block,
+    api_key,
+    contract_address,
+    output,
+    prefetch_depth=2,
+    checkpoint=None,
+):
+    get_nft_transfers_for_contracts(
+        start_block=start_block,
+        end_block=end_block,
+        api_key=api_key,
+        outputs={contract_address: output},
+        prefetch_depth=prefetch_depth,
+        checkpoint=checkpoint,
     )
-    page_key = None
-    process_active = True
-
-    # Loop through calls using pagination tokens until complete
-    while process_active:
-        if not page_key:
-            alchemy_url = "https://eth-mainnet.g.alchemy.com/v2/{api_key}/".format(
-                api_key=api_key,
+
+
+def get_nft_transfers_for_contracts(
+    start_block, end_block, api_key, outputs, prefetch_depth=2, checkpoint=None
+):
+    # Fetch transfers for several contracts over the same block range, paging through
+    # them with one cursor per chunk of contracts and demultiplexing rows into
+    # per-contract output files. outputs maps each contract address to its output file.
+    # With a run checkpoint, each chunk resumes from its last committed page.
+    alchemy_url = "https://eth-mainnet.g.alchemy.com/v2/{api_key}/".format(
+        api_key=api_key,
+    )
+    contract_addresses = list(outputs)
+
+    def fetch_page(contract_addresses_chunk, page_key):
+        request_params = {
+            "fromBlock": hex(start_block),
+            "toBlock": hex(end_block),
+            "contractAddresses": contract_addresses_chunk,
+            "category": ["erc721", "erc1155"],
+            "maxCount": "0x3e8",
+        }
+        if page_key:
+            request_params["pageKey"] = page_key
+
+        post_request_params = {
+            "id": 1,
+            "jsonrpc": "2.0",
+            "method": "alchemy_getAssetTransfers",
+            "params": [request_params],
+        }
+
+        def fetch():
+            r = alchemy_client.post(
+                alchemy_url,
+                json=post_request_params,
+                cost=ALCHEMY_COMPUTE_UNITS["alchemy_getAssetTransfers"],
             )
-            post_request_params = {
-                "id": 1,
-                "jsonrpc": "2.0",
-                "method": "alchemy_getAssetTransfers",
-                "params": [
-                    {
-                        "fromBlock": hex(start_block),
-                        "toBlock": hex(end_block),
-                        "contractAddresses": [contract_address],
-                        "category": ["erc721", "erc1155"],
-                        "maxCount": "0x3e8",
-                    }
-                ],
-            }
+            j = r.json()
+            j["result"]["transfers"]
+            return j
+
+        return fetch_with_retries(fetch)
+
+    # Rows are written to the output files page by page, so memory and CPU stay
+    # linear in the number of transfers
+    for chunk_start in range(
+        0, len(contract_addresses), MAX_CONTRACT_ADDRESSES_PER_REQUEST
+    ):
+        contract_addresses_chunk = contract_addresses[
+            chunk_start : chunk_start + MAX_CONTRACT_ADDRESSES_PER_REQUEST
+        ]
+        label = "Transfers {}-{}".format(start_block, end_block)
+        if len(contract_addresses) > 1:
+            label += " ({} contracts)".format(len(contract_addresses_chunk))
 
+        if checkpoint is None:
+            page_checkpoint = PageCheckpoint()
         else:
-            alchemy_url = "https://eth-mainnet.g.alchemy.com/v2/{api_key}/".format(
-                api_key=api_key,
+            page_checkpoint = checkpoint.job(
+                "|".join(outputs[c] for c in contract_addresses_chunk),
+                start_block=start_block,
+                end_block=end_block,
             )
-            post_request_params = {
-                "id": 1,
-                "jsonrpc": "2.0",
-                "method": "alchemy_getAssetTransfers",
-                "params": [
-                    {
-                        "fromBlock": hex(start_block),
-                        "toBlock": hex(end_block),
-                        "contractAddresses": [contract_address],
-                        "category": ["erc721", "erc1155"],
-                        "maxCount": "0x3e8",
-                        "pageKey": page_key,
-                    }
-                ],
-            }
-
-        # Sometimes requests can randomly fail. Retry 3 times before timing out.
-        retries = 3
-        for i in range(retries):
-            try:
-                r = requests.post(alchemy_url, json=post_request_params)
-                j = r.json()
-
-                transfers = j["result"]["transfers"]
-                for transfer in transfers:
+            if page_checkpoint.done:
+                continue
+            if page_checkpoint.resumed:
+                label += " (resumed)"
+
+        with contextlib.ExitStack() as stack:
+            writers = {}
+            for contract_address in contract_addresses_chunk:
+                output_file = stack.enter_context(
+                    page_checkpoint.open_output(outputs[contract_address])
+                )
+                writers[contract_address.lower()] = csv.writer(output_file)
+                if output_file.tell() == 0:
+                    writers[contract_address.lower()].writerow(TRANSFER_COLUMNS)
+
+            # Loop through calls using pagination tokens until complete
+            for j in paginate(
+                lambda page_key: fetch_page(contract_addresses_chunk, page_key),
+                lambda j: j["result"].get("pageKey"),
+                prefetch_depth=prefetch_depth,
+                label=label,
+                start_cursor=page_checkpoint.cursor,
+            ):
+                transfers_by_contract = {}
+                for transfer in j["result"]["transfers"]:
                     try:
-                        nft_transfers_df = pd.DataFrame(
-                            columns=[
-                                "transaction_hash",
-                                "block_number",
-                                "asset_id",
-                                "from_address",
-                                "to_address",
-                                "value",
-                                "log_index",
-                            ]
-                        )
-
-                        transaction_hash = transfer["hash"]
-                        block_number = int(transfer["blockNum"], 16)
-
-                        if transfer["category"] == "erc1155":
-                            asset_id = int(
-                                transfer["erc1155Metadata"][0]["tokenId"], 16
-                            )
-                            value = int(transfer["erc1155Metadata"][0]["value"], 16)
-                        else:
-                            asset_id = int(transfer["erc721TokenId"], 16)
-                            value = 1
-
-                        from_address = transfer["from"]
-                        to_address = transfer["to"]
-                        log_index_substr = len(transfer["uniqueId"]) - 71
-                        log_index = transfer["uniqueId"][-log_index_substr:]
-
-                        nft_transfers_dict = {
-                            "transaction_hash": [transaction_hash],
-                            "block_number": [block_number],
-                            "asset_id": [asset_id],
-                            "from_address": [from_address],
-                            "to_address": [to_address],
-                            "value": [value],
-                            "log_index": [log_index],
-                        }
-
-                        nft_transfers_df = pd.DataFrame(nft_transfers_dict)
-                        nft_transfers = pd.concat(
-                            [nft_transfers, nft_transfers_df], ignore_index=True
-                        )
-
+                        contract_address = transfer["rawContract"]["address"].lower()
                     except:
-                        continue
-
-                try:
-                    page_key = j["result"]["pageKey"]
-                except:
-                    process_active = False
-            except KeyError:
-                if i < retries - 1:
-                    print("Alchemy request failed. Retrying request...")
-                    sleep(5)
-                    continue
-                else:
-                    raise
-            break
-
-    # Output attributes data to CSV file
-    nft_transfers.to_csv(output, index=False)
+                        if len(contract_addresses) > 1:
+                            continue
+                        contract_address = contract_addresses[0].lower()
+                    transfers_by_contract.setdefault(contract_address, []).append(
+                        transfer
+                    )
+
+                for contract_address, transfers in transfers_by_contract.items():
+                    if contract_address in writers:
+                        writers[contract_address].writerows(decode_transfers(transfers))
+
+                page_checkpoint.commit(j["result"].get("pageKey"))
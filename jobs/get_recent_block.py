@@ -6,7 +6,7 @@ from utils.find_deployment_block_for_contract import \
     find_deployment_block_for_contract
 
 
-def get_recent_block(update_log_file, contract_address, web3):
+def get_recent_block(update_log_file, contract_address, web3, rpc=None, batch_size=1):
     print("Checking update logs for most recent block...")
 
     # Check if update log file exists
@@ -17,7 +17,9 @@ def get_recent_block(update_log_file, contract_address, web3):
         print("Starting with block " + str(most_recent_block))
     else:
         # If file does not exist, find contract deployment block
-        most_recent_block = find_deployment_block_for_contract(contract_address, web3)
+        most_recent_block = find_deployment_block_for_contract(
+            contract_address, web3, rpc=rpc, batch_size=batch_size
+        )
 
         print(
             "No existing data. Contract {} appears to have been deployed at block {}".format(
@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import pandas as pd
 
@@ -19,28 +19,22 @@ def update_block_to_date_mapping(filename, eth_service):
     # Count the number of days to update
     days_to_update = t1 - last_date_updated
 
-    # Update date block mapping using the get_block_range_for_date method in ethereum_etl
+    # Update date block mapping, resolving the block ranges of all missing days in
+    # one sweep over their boundaries
+    dates = [
+        t1 - timedelta(days=days_prior) for days_prior in range(days_to_update.days)
+    ]
+    date_ranges = eth_service.get_block_ranges_for_dates(dates) if dates else []
+
     date_block_mapping = pd.DataFrame(
-        columns=("date", "starting_block", "ending_block")
+        {
+            "date": [date.strftime("%Y-%m-%d") for date in dates],
+            "starting_block": [date_range[0] for date_range in date_ranges],
+            "ending_block": [date_range[1] for date_range in date_ranges],
+        },
+        columns=("date", "starting_block", "ending_block"),
     )
 
-    for days_prior in range(days_to_update.days):
-        date_updated = t1 - timedelta(days=days_prior)
-        date_updated_ouput = date_updated.strftime("%Y-%m-%d")
-        date_updated_input = (
-            datetime.today() - timedelta(days=1) - timedelta(days=days_prior)
-        )
-
-        date_range = eth_service.get_block_range_for_date(date_updated_input)
-
-        new_dict = {
-            "date": [date_updated_ouput],
-            "starting_block": date_range[0],
-            "ending_block": date_range[1],
-        }
-        new_df = pd.DataFrame(new_dict)
-        date_block_mapping = pd.concat([date_block_mapping, new_df], ignore_index=True)
-
     date_block_mapping.sort_values(by="date", ascending=True, inplace=True)
 
     # If there are updates, output data to CSV file
@@ -48,3 +42,25 @@ def update_block_to_date_mapping(filename, eth_service):
         date_block_mapping.to_csv(filename, header=False, index=False, mode="a")
     else:
         pass
+
+
+def get_provisional_date_block_mapping(eth_service, web3, end_block):
+    # Mapping row for today's blocks up to end_block. It is not persisted, since the
+    # day is not complete yet; the full row is added once the day has ended.
+    today = datetime.now(timezone.utc).date()
+    start_of_today = datetime.combine(
+        today, datetime.min.time().replace(tzinfo=timezone.utc)
+    ).timestamp()
+    end_timestamp = web3.eth.get_block(end_block).timestamp
+
+    date_block_mapping = pd.DataFrame(
+        columns=("date", "starting_block", "ending_block")
+    )
+    if end_timestamp < start_of_today:
+        return date_block_mapping
+
+    starting_block, _ = eth_service.get_block_range_for_timestamps(
+        start_of_today, end_timestamp
+    )
+    date_block_mapping.loc[0] = [today.strftime("%Y-%m-%d"), starting_block, end_block]
+    return date_block_mapping
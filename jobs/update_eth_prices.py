@@ -1,14 +1,29 @@
-from datetime import datetime, timedelta
-from time import sleep
+import os
+from datetime import datetime, timedelta, timezone
 
 import pandas as pd
-import requests
 
+from jobs.update_hour_block_mapping import HOURLY_BACKFILL_DAYS, hours_to_update
+from utils.block_hour_index import SECONDS_PER_HOUR
+from utils.eth_price_sources import (
+    MAX_DAYS_PER_RANGE_REQUEST,
+    CoinGeckoHistoryPriceSource,
+    CoinGeckoRangePriceSource,
+)
 
-def update_eth_prices(filename):
+
+def default_price_sources():
+    # Bulk range requests first; the per-day endpoint fills any dates they missed
+    return [CoinGeckoRangePriceSource(), CoinGeckoHistoryPriceSource()]
+
+
+def update_eth_prices(filename, sources=None):
     # Update ETH prices file
     print("Updating ETH prices...")
 
+    if sources is None:
+        sources = default_price_sources()
+
     # Find today's date
     t0 = datetime.today().date()
 
@@ -18,42 +33,86 @@ def update_eth_prices(filename):
         eth_prices_df.iloc[-1]["date"], "%Y-%m-%d"
     ).date()
 
-    # Count the number of days to update
+    # Find the dates to update
     days_to_update = t0 - last_date_updated
+    missing_dates = [
+        t0 - timedelta(days=days_prior) for days_prior in range(days_to_update.days)
+    ]
+
+    # Ask each source for the dates that are still missing. A failing source is
+    # skipped, unless it is the last one.
+    frames = []
+    for i, source in enumerate(sources):
+        if len(missing_dates) == 0:
+            break
+        try:
+            prices = source.get_prices(missing_dates)
+        except Exception as e:
+            if i == len(sources) - 1:
+                raise
+            print(
+                "{} failed ({}); trying the next price source.".format(
+                    type(source).__name__, e
+                )
+            )
+            continue
+
+        frames.append(prices)
+        found = set(prices["date"])
+        missing_dates = [
+            d for d in missing_dates if d.strftime("%Y-%m-%d") not in found
+        ]
+
+    if len(missing_dates) > 0:
+        print("No ETH price found for {} days".format(len(missing_dates)))
+
+    eth_prices = pd.concat(
+        [pd.DataFrame(columns=("date", "price_of_eth"))] + frames, ignore_index=True
+    )
+    eth_prices.sort_values(by="date", ascending=True, inplace=True)
 
-    # Update ETH prices using CoinGecko API calls
-    eth_prices = pd.DataFrame(columns=("date", "price_of_eth"))
-
-    for days_prior in range(days_to_update.days):
-        date_updated = t0 - timedelta(days=days_prior)
-        date_updated_input = str(date_updated.strftime("%d-%m-%Y"))
-        date_updated_ouput = str(date_updated.strftime("%Y-%m-%d"))
+    # If there are updates, output data to CSV file
+    if eth_prices["date"].size != 0:
+        eth_prices.to_csv(filename, header=False, index=False, mode="a")
 
-        # Sleep for 10 seconds between API calls to avoid hitting rate limits
-        sleep(10)
 
-        # CoinGecko API Request
-        url = "https://api.coingecko.com/api/v3/coins/ethereum/history?date={date_updated}".format(
-            date_updated=date_updated_input
+def update_hourly_eth_prices(filename, backfill_days=HOURLY_BACKFILL_DAYS):
+    # Update hourly ETH prices file, with the last price at or before the start of
+    # each hour (by unix timestamp), so that a sale is never priced with a price
+    # sampled after it
+    print("Updating hourly ETH prices...")
+
+    hours = hours_to_update(filename, backfill_days)
+
+    # Ranges of up to 90 days are returned at an hourly granularity. Each range starts
+    # an hour before its first hour, for the price at the start of that hour.
+    source = CoinGeckoRangePriceSource()
+    hours_per_request = MAX_DAYS_PER_RANGE_REQUEST * 24
+    frames = []
+    for i in range(0, len(hours), hours_per_request):
+        window = hours[i : i + hours_per_request]
+        points = source.get_price_points(
+            datetime.fromtimestamp(window[0] - SECONDS_PER_HOUR, timezone.utc),
+            datetime.fromtimestamp(window[-1], timezone.utc),
+        )
+        hourly = points.resample("h", closed="right", label="right").last().dropna()
+        frames.append(
+            pd.DataFrame(
+                {
+                    "timestamp": hourly.index.as_unit("s").asi8,
+                    "price_of_eth": hourly.to_numpy(),
+                }
+            )
         )
-        headers = {
-            "Accept": "application/json",
-        }
-
-        r = requests.get(url, headers=headers, timeout=90)
-        j = r.json()
-
-        price_of_eth = j["market_data"]["current_price"]["usd"]
-
-        new_dict = {"date": [date_updated_ouput], "price_of_eth": [price_of_eth]}
-        new_df = pd.DataFrame(new_dict)
-        eth_prices = pd.concat([eth_prices, new_df], ignore_index=True)
 
-    eth_prices.sort_values(by="date", ascending=True, inplace=True)
+    eth_prices = pd.concat(
+        [pd.DataFrame(columns=("timestamp", "price_of_eth"))] + frames,
+        ignore_index=True,
+    )
+    eth_prices = eth_prices[eth_prices["timestamp"].isin(hours)]
 
     # If there are updates, output data to CSV file
-    if eth_prices["date"].size != 0:
-        eth_prices.to_csv(filename, header=False, index=False, mode="a")
-
-    else:
-        pass
+    if eth_prices["timestamp"].size != 0:
+        eth_prices.to_csv(
+            filename, header=not os.path.isfile(filename), index=False, mode="a"
+        )
@@ -0,0 +1,59 @@
+import os
+import time
+
+import pandas as pd
+
+from utils.block_hour_index import SECONDS_PER_HOUR
+
+# Number of days of hours mapped when the hour block mapping is first created
+HOURLY_BACKFILL_DAYS = 90
+
+# Hours are only mapped once they ended at least this many seconds ago, so that
+# their last block is final
+HOUR_SETTLE_SECONDS = 600
+
+
+def hours_to_update(filename, backfill_days=HOURLY_BACKFILL_DAYS):
+    # Start timestamps of the complete hours after the last hour in an hourly file,
+    # or of the last backfill_days days when the file does not exist yet
+    last_complete_hour = (
+        (int(time.time()) - HOUR_SETTLE_SECONDS) // SECONDS_PER_HOUR - 1
+    ) * SECONDS_PER_HOUR
+    if os.path.isfile(filename):
+        first_hour = int(pd.read_csv(filename).iloc[-1]["timestamp"]) + SECONDS_PER_HOUR
+    else:
+        first_hour = last_complete_hour - backfill_days * 24 * SECONDS_PER_HOUR
+    return list(range(first_hour, last_complete_hour + 1, SECONDS_PER_HOUR))
+
+
+def update_hour_block_mapping(
+    filename, eth_service, backfill_days=HOURLY_BACKFILL_DAYS
+):
+    # Update hour block mapping file
+    print("Updating block-to-hour mapping...")
+
+    hours = hours_to_update(filename, backfill_days)
+
+    # Resolve the blocks at all hour boundaries in one sweep
+    hour_ranges = []
+    if len(hours) > 0:
+        hour_ranges = eth_service.get_block_ranges_for_intervals(
+            hours + [hours[-1] + SECONDS_PER_HOUR]
+        )
+    rows = [
+        (hour, starting_block, ending_block)
+        for hour, (starting_block, ending_block) in zip(hours, hour_ranges)
+    ]
+
+    hour_block_mapping = pd.DataFrame(
+        rows, columns=("timestamp", "starting_block", "ending_block")
+    )
+
+    # If there are updates, output data to CSV file
+    if hour_block_mapping["timestamp"].size != 0:
+        hour_block_mapping.to_csv(
+            filename,
+            header=not os.path.isfile(filename),
+            index=False,
+            mode="a",
+        )
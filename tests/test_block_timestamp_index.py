@@ -0,0 +1,29 @@
+from utils.block_timestamp_index import BlockTimestampIndex
+from utils.eth_service import CONFIRMATIONS, EthService, Point
+
+
+class FakeBlockTimestampGraph(object):
+    def __init__(self, last_x):
+        self.last_x = last_x
+
+    def get_last_point(self):
+        return Point(self.last_x, self.last_x * 12)
+
+    def get_points(self, xs):
+        return [Point(x, x * 12) for x in xs]
+
+
+def test_fill_keeps_blocks_near_head_out_of_index_file(tmp_path):
+    filename = str(tmp_path / "block_timestamps.u32")
+    eth_service = EthService(web3=None, timestamp_index=BlockTimestampIndex(filename))
+    eth_service._graph = FakeBlockTimestampGraph(last_x=1000)
+    confirmed_x = 1000 - CONFIRMATIONS
+
+    assert eth_service.fill_block_timestamps([10, confirmed_x, confirmed_x + 1]) == 3
+    assert list(
+        eth_service.timestamp_index.get_timestamps([10, confirmed_x, confirmed_x + 1])
+    ) == [120, confirmed_x * 12, (confirmed_x + 1) * 12]
+
+    reopened_index = BlockTimestampIndex(filename)
+    assert reopened_index.get_timestamps([confirmed_x]).tolist() == [confirmed_x * 12]
+    assert reopened_index.missing([10, confirmed_x + 1]).tolist() == [confirmed_x + 1]
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from jobs.cleanup_outputs import merge_into_consolidated_output
+
+
+def test_merge_with_changed_columns_streams_existing_rows(tmp_path):
+    consolidated_file = str(tmp_path / "transfers.csv")
+    run_file = str(tmp_path / "transfers_1.csv")
+    with open(consolidated_file, "w") as f:
+        f.write(
+            "transaction_hash,block_number,value\n"
+            "h3,300,1.50\n"
+            "h2,200,007\n"
+            "h1,100,\n"
+        )
+    pd.DataFrame(
+        {
+            "transaction_hash": ["h4"],
+            "block_number": [300],
+            "block_timestamp": [1677628800],
+            "value": [2],
+        }
+    ).to_csv(run_file, index=False)
+
+    merge_into_consolidated_output(
+        [run_file], consolidated_file, from_block=300, chunksize=1
+    )
+
+    with open(consolidated_file) as f:
+        assert f.read().splitlines() == [
+            "transaction_hash,block_number,block_timestamp,value",
+            "h4,300,1677628800,2",
+            "h2,200,,007",
+            "h1,100,,",
+        ]
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from utils import external_sort
+
+
+def test_sort_merges_more_runs_than_fan_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(external_sort, "MAX_MERGE_FAN_IN", 3)
+    merge_sizes = []
+    merge_runs = external_sort.merge_runs
+
+    def recording_merge_runs(run_files, *args):
+        merge_sizes.append(len(run_files))
+        merge_runs(run_files, *args)
+
+    monkeypatch.setattr(external_sort, "merge_runs", recording_merge_runs)
+
+    df = pd.DataFrame(
+        {
+            "block_number": [(i * 37) % 101 for i in range(200)],
+            "log_index": [i % 7 for i in range(200)],
+            "transaction_hash": ["h{}".format(i) for i in range(200)],
+        }
+    )
+    output = tmp_path / "sorted.csv"
+    external_sort.sort_chunks_to_csv(
+        (df.iloc[i : i + 10] for i in range(0, len(df), 10)),
+        str(output),
+        by=["block_number", "log_index"],
+        ascending=[False, True],
+    )
+
+    assert len(merge_sizes) > 1
+    assert max(merge_sizes) <= 3
+    expected = df.sort_values(
+        by=["block_number", "log_index"], ascending=[False, True], kind="stable"
+    )
+    pd.testing.assert_frame_equal(pd.read_csv(output), expected.reset_index(drop=True))
+    assert list(tmp_path.iterdir()) == [output]
@@ -0,0 +1,17 @@
+import pytest
+
+from utils.json_rpc import JsonRpcError, get_block_timestamps
+
+
+class FakeBatchClient(object):
+    def __init__(self, results):
+        self.results = results
+
+    def batch(self, calls):
+        return self.results
+
+
+def test_get_block_timestamps_of_missing_block_raises():
+    rpc = FakeBatchClient([{"number": "0x1", "timestamp": "0xc"}, None])
+    with pytest.raises(JsonRpcError, match="block 2"):
+        get_block_timestamps(rpc, [1, 2])
@@ -0,0 +1,99 @@
+import pandas as pd
+
+from jobs.cleanup_outputs import clean_up_outputs
+from utils.storage import append_to_dataset, render_dataset_to_csv
+
+CONTRACT_ADDRESS = "0xABC"
+
+TRANSFER_COLUMNS = [
+    "transaction_hash",
+    "block_number",
+    "date",
+    "asset_id",
+    "from_address",
+    "to_address",
+    "log_index",
+    "value",
+]
+
+
+def transfers_df(rows, columns=TRANSFER_COLUMNS):
+    return pd.DataFrame(rows, columns=columns)
+
+
+def test_switching_to_parquet_keeps_csv_history(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    transfers_df(
+        [
+            ["h2", 100, "2023-01-02", 2, "a", "b", 0, 1],
+            ["h1", 50, "2023-01-01", 1, "a", "b", 0, 1],
+        ]
+    ).to_csv("transfers_" + CONTRACT_ADDRESS + ".csv", index=False)
+    transfers_df([["h3", 200, "2023-02-01", 3, "a", "b", 0, 1]]).to_csv(
+        "transfers_" + CONTRACT_ADDRESS + "_1.csv", index=False
+    )
+
+    clean_up_outputs(CONTRACT_ADDRESS, from_block=200, storage_format="parquet")
+
+    output_df = pd.read_csv("transfers_" + CONTRACT_ADDRESS + ".csv")
+    assert list(output_df["block_number"]) == [200, 100, 50]
+    assert list(output_df["transaction_hash"]) == ["h3", "h2", "h1"]
+
+
+def test_render_aligns_partitions_with_added_columns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    append_to_dataset(
+        transfers_df([["h1", 100, "2023-01-02", 1, "a", "b", 1, 1]]),
+        kind="transfers",
+        contract_address=CONTRACT_ADDRESS,
+    )
+    new_columns = TRANSFER_COLUMNS[:3] + ["block_timestamp"] + TRANSFER_COLUMNS[3:]
+    append_to_dataset(
+        transfers_df(
+            [["h2", 200, "2023-02-01", 1675209600, 2, "a", "b", 0, 1]],
+            columns=new_columns,
+        ),
+        kind="transfers",
+        contract_address=CONTRACT_ADDRESS,
+    )
+
+    render_dataset_to_csv(
+        kind="transfers",
+        contract_address=CONTRACT_ADDRESS,
+        output="transfers.csv",
+        columns=new_columns,
+    )
+
+    with open("transfers.csv") as f:
+        lines = f.read().splitlines()
+    assert lines == [
+        ",".join(new_columns),
+        "h2,200,2023-02-01,1675209600,2,a,b,0,1",
+        "h1,100,2023-01-02,,1,a,b,1,1",
+    ]
+
+
+def test_parquet_cleanup_streams_run_files_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    transfers_df(
+        [
+            ["h3", 300, "2023-03-01", 3, "a", "b", 0, 1],
+            ["h2", 200, "2023-02-01", 2, "a", "b", 0, 1],
+            ["h1", 100, "2023-01-01", 1, "a", "b", 0, 1],
+        ]
+    ).to_csv("transfers_" + CONTRACT_ADDRESS + ".csv", index=False)
+    transfers_df(
+        [
+            ["h6", 400, "2023-03-02", 6, "a", "b", 1, 1],
+            ["h5", 400, "2023-03-02", 5, "a", "b", 0, 1],
+            ["h4", 200, "2023-02-01", 4, "a", "b", 0, 1],
+        ]
+    ).to_csv("transfers_" + CONTRACT_ADDRESS + "_1.csv", index=False)
+
+    clean_up_outputs(
+        CONTRACT_ADDRESS, from_block=200, storage_format="parquet", chunksize=1
+    )
+
+    output_df = pd.read_csv("transfers_" + CONTRACT_ADDRESS + ".csv")
+    assert list(output_df.columns) == TRANSFER_COLUMNS
+    assert list(output_df["transaction_hash"]) == ["h6", "h5", "h4", "h1"]
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from jobs import update_eth_prices
+from utils.eth_price_sources import CoinGeckoRangePriceSource
+
+HOUR = 1672531200
+
+
+def test_hourly_price_is_last_sample_at_or_before_hour_start(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        update_eth_prices,
+        "hours_to_update",
+        lambda filename, backfill_days: [HOUR, HOUR + 3600],
+    )
+    samples = {
+        HOUR - 3420: 1000.0,
+        HOUR + 180: 1010.0,
+        HOUR + 3600: 1020.0,
+        HOUR + 3780: 1030.0,
+    }
+    monkeypatch.setattr(
+        CoinGeckoRangePriceSource,
+        "get_price_points",
+        lambda self, start, end: pd.Series(
+            list(samples.values()), index=pd.to_datetime(list(samples), unit="s")
+        ),
+    )
+    filename = str(tmp_path / "eth_prices_hourly.csv")
+
+    update_eth_prices.update_hourly_eth_prices(filename)
+
+    prices_df = pd.read_csv(filename)
+    assert list(prices_df["timestamp"]) == [HOUR, HOUR + 3600]
+    assert list(prices_df["price_of_eth"]) == [1000.0, 1020.0]
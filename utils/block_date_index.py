@@ -0,0 +1,46 @@
+import numpy as np
+
+from utils.storage import read_table
+
+
+class BlockDateIndex(object):
+    def __init__(self, date_blocks_df):
+        """Sorted block-to-date lookup built once from the date block mapping"""
+        date_blocks_df = date_blocks_df.sort_values(by="starting_block")
+        self._starting_blocks = date_blocks_df["starting_block"].to_numpy(
+            dtype=np.int64
+        )
+        self._ending_blocks = date_blocks_df["ending_block"].to_numpy(dtype=np.int64)
+        self._dates = date_blocks_df["date"].to_numpy(dtype=object)
+
+    @classmethod
+    def from_file(cls, date_block_mapping_file):
+        return cls(read_table(date_block_mapping_file))
+
+    def get_dates(self, block_numbers, label="rows"):
+        # Find the day each block belongs to with a binary search over starting blocks.
+        # Blocks outside the mapping get an empty date instead of raising.
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        positions = (
+            np.searchsorted(self._starting_blocks, block_numbers, side="right") - 1
+        )
+
+        clipped_positions = np.clip(positions, 0, max(len(self._dates) - 1, 0))
+        in_mapping = (positions >= 0) & (len(self._dates) > 0)
+        if len(self._dates) > 0:
+            in_mapping &= block_numbers <= self._ending_blocks[clipped_positions]
+
+        dates = np.full(len(block_numbers), np.nan, dtype=object)
+        dates[in_mapping] = self._dates[clipped_positions[in_mapping]]
+
+        num_missing = int((~in_mapping).sum())
+        if num_missing > 0:
+            missing_blocks = block_numbers[~in_mapping]
+            print(
+                "Warning: {} {} in blocks {}-{} are not covered by the block-to-date mapping; "
+                "their date is left empty.".format(
+                    num_missing, label, missing_blocks.min(), missing_blocks.max()
+                )
+            )
+
+        return dates
@@ -0,0 +1,49 @@
+import numpy as np
+
+from utils.storage import read_table
+
+SECONDS_PER_HOUR = 3600
+
+
+class BlockHourIndex(object):
+    def __init__(self, hour_blocks_df):
+        """Sorted block-to-time lookup built once from the hour block mapping, which holds
+        the first and last block of each hour (by unix timestamp of the hour's start)
+        """
+        hour_blocks_df = hour_blocks_df.sort_values(by="starting_block")
+        self._starting_blocks = hour_blocks_df["starting_block"].to_numpy(
+            dtype=np.int64
+        )
+        self._ending_blocks = hour_blocks_df["ending_block"].to_numpy(dtype=np.int64)
+        self._hours = hour_blocks_df["timestamp"].to_numpy(dtype=np.int64)
+
+    @classmethod
+    def from_file(cls, hour_block_mapping_file):
+        return cls(read_table(hour_block_mapping_file))
+
+    def get_timestamps(self, block_numbers):
+        # Estimate the timestamp of each block by interpolating between the first and
+        # last block of its hour. Blocks outside the mapping get NaN.
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        timestamps = np.full(len(block_numbers), np.nan)
+        if len(self._hours) == 0:
+            return timestamps
+
+        positions = (
+            np.searchsorted(self._starting_blocks, block_numbers, side="right") - 1
+        )
+        clipped_positions = np.clip(positions, 0, len(self._hours) - 1)
+        in_mapping = (positions >= 0) & (
+            block_numbers <= self._ending_blocks[clipped_positions]
+        )
+
+        positions = clipped_positions[in_mapping]
+        starting_blocks = self._starting_blocks[positions]
+        num_blocks = self._ending_blocks[positions] - starting_blocks + 1
+        timestamps[in_mapping] = (
+            self._hours[positions]
+            + (block_numbers[in_mapping] - starting_blocks)
+            * SECONDS_PER_HOUR
+            / num_blocks
+        )
+        return timestamps
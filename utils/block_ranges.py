@@ -0,0 +1,127 @@
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def split_block_range(start_block, end_block, num_shards, date_block_mapping_file=None):
+    # Split [start_block, end_block] into up to num_shards contiguous, inclusive sub-ranges.
+    # When the date block mapping covers the whole range, shards span equal amounts of
+    # calendar time rather than equal block counts, since block times have changed over
+    # the history of the chain.
+    num_shards = max(1, min(num_shards, end_block - start_block + 1))
+    boundaries = None
+
+    if date_block_mapping_file is not None and os.path.isfile(date_block_mapping_file):
+        boundaries = time_weighted_boundaries(
+            start_block, end_block, num_shards, pd.read_csv(date_block_mapping_file)
+        )
+
+    if boundaries is None:
+        boundaries = np.linspace(start_block, end_block + 1, num_shards + 1)
+
+    boundaries = np.unique(np.round(boundaries).astype(np.int64))
+    boundaries[0] = start_block
+    boundaries[-1] = end_block + 1
+
+    return [
+        (int(shard_start), int(shard_end) - 1)
+        for shard_start, shard_end in zip(boundaries[:-1], boundaries[1:])
+        if shard_end > shard_start
+    ]
+
+
+def time_weighted_boundaries(start_block, end_block, num_shards, date_blocks_df):
+    # Return shard boundaries such that each shard covers the same fraction of days,
+    # or None if the mapping does not cover the block range
+    date_blocks_df = date_blocks_df.sort_values(by="starting_block")
+    if (
+        date_blocks_df.empty
+        or start_block < date_blocks_df["starting_block"].iloc[0]
+        or end_block > date_blocks_df["ending_block"].iloc[-1]
+    ):
+        return None
+
+    starting_blocks = date_blocks_df["starting_block"].to_numpy(dtype=np.int64)
+    ending_blocks = date_blocks_df["ending_block"].to_numpy(dtype=np.int64) + 1
+
+    # Clip each day to the requested range; each block weighs 1 / blocks in its day
+    clipped_starts = np.clip(starting_blocks, start_block, end_block + 1)
+    clipped_ends = np.clip(ending_blocks, start_block, end_block + 1)
+    day_weights = (clipped_ends - clipped_starts) / (ending_blocks - starting_blocks)
+    cumulative_weights = np.concatenate(([0.0], np.cumsum(day_weights)))
+
+    targets = np.linspace(0, cumulative_weights[-1], num_shards + 1)
+    days = np.clip(
+        np.searchsorted(cumulative_weights, targets, side="right") - 1,
+        0,
+        len(day_weights) - 1,
+    )
+    blocks_into_day = (targets - cumulative_weights[days]) * (
+        ending_blocks[days] - starting_blocks[days]
+    )
+    return clipped_starts[days] + blocks_into_day
+
+
+def fetch_block_range_in_shards(
+    fetch_range,
+    start_block,
+    end_block,
+    output,
+    shards,
+    sort_columns,
+    date_block_mapping_file=None,
+    shard_dir=None,
+):
+    # Call fetch_range(shard_start, shard_end, shard_output) for each shard concurrently,
+    # then merge the shard outputs into a single CSV in block order.
+    # Requests made by fetch_range should go through a shared rate limiter.
+    # Shard outputs are written to shard_dir when given (e.g. to resume an interrupted
+    # run), or to a temporary directory otherwise.
+    block_ranges = split_block_range(
+        start_block, end_block, shards, date_block_mapping_file
+    )
+    if len(block_ranges) == 1:
+        fetch_range(start_block, end_block, output)
+        return
+
+    print(
+        "Fetching blocks {}-{} in {} shards...".format(
+            start_block, end_block, len(block_ranges)
+        )
+    )
+
+    with contextlib.ExitStack() as stack:
+        if shard_dir is None:
+            shard_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        else:
+            os.makedirs(shard_dir, exist_ok=True)
+
+        shard_outputs = [
+            os.path.join(shard_dir, "shard_{}.csv".format(i))
+            for i in range(len(block_ranges))
+        ]
+
+        with ThreadPoolExecutor(max_workers=len(block_ranges)) as executor:
+            futures = [
+                executor.submit(fetch_range, shard_start, shard_end, shard_output)
+                for (shard_start, shard_end), shard_output in zip(
+                    block_ranges, shard_outputs
+                )
+            ]
+            for future in futures:
+                future.result()
+
+        # Shards cover ascending, non-overlapping block ranges, so sorting each shard
+        # and concatenating them in shard order yields a deterministic global order
+        with open(output, "w", newline="") as output_file:
+            for i, shard_output in enumerate(shard_outputs):
+                # Read values as text so they are written back exactly as fetched
+                shard_df = pd.read_csv(shard_output, dtype=str)
+                shard_df = shard_df.sort_values(
+                    by=sort_columns, key=pd.to_numeric, kind="stable"
+                )
+                shard_df.to_csv(output_file, header=(i == 0), index=False)
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+
+
+class SortedPointCache(object):
+    def __init__(self):
+        """In-memory block number -> timestamp points kept sorted for bisect lookups"""
+        self._xs = []
+        self._ys = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._xs)
+
+    def add(self, x, y, persist=True):
+        with self._lock:
+            i = bisect_left(self._xs, x)
+            if i < len(self._xs) and self._xs[i] == x:
+                return False
+            self._xs.insert(i, x)
+            self._ys.insert(i, y)
+            return True
+
+    def find_bounds(self, y):
+        # Closest cached points (x, y) that bound the y coordinate, or None if y is outside the cache
+        with self._lock:
+            i = bisect_left(self._ys, y)
+            if i == len(self._ys):
+                return None
+            if self._ys[i] == y:
+                return (self._xs[i], self._ys[i]), (self._xs[i], self._ys[i])
+            if i == 0:
+                return None
+            return (self._xs[i - 1], self._ys[i - 1]), (self._xs[i], self._ys[i])
+
+    def flush(self):
+        pass
+
+
+class BlockTimestampCache(SortedPointCache):
+    def __init__(self, filename):
+        """Sorted block number -> timestamp points persisted to a SQLite table, so that
+        block searches in later runs start from every block probed before
+        """
+        super().__init__()
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS block_timestamps "
+            "(block_number INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)"
+        )
+        rows = self._connection.execute(
+            "SELECT block_number, timestamp FROM block_timestamps ORDER BY block_number"
+        ).fetchall()
+        self._xs = [row[0] for row in rows]
+        self._ys = [row[1] for row in rows]
+        self._pending = []
+
+    def add(self, x, y, persist=True):
+        added = super().add(x, y)
+        if added and persist:
+            with self._lock:
+                self._pending.append((x, y))
+        return added
+
+    def flush(self):
+        # Write points added since the last flush back to disk
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR IGNORE INTO block_timestamps VALUES (?, ?)", pending
+                    )
@@ -0,0 +1,90 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+BLOCK_TIMESTAMP_INDEX_FILE = "./raw-data/block_timestamps.u32"
+
+
+class BlockTimestampIndex(object):
+    def __init__(self, filename=BLOCK_TIMESTAMP_INDEX_FILE):
+        """Block number -> unix timestamp for every block seen so far, stored as a memory-mapped
+        uint32 array indexed by block number, with 0 for blocks whose timestamp is unknown.
+        The file only grows, and timestamps are written once, so lookups are a single array access.
+        Blocks that may still be reorged are kept in memory only
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._timestamps = None
+        self._unconfirmed = {}
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.isfile(filename):
+            open(filename, "wb").close()
+        self._map()
+
+    def __len__(self):
+        return len(self._timestamps) if self._timestamps is not None else 0
+
+    def _map(self):
+        size = os.path.getsize(self.filename) // 4
+        if size == 0:
+            self._timestamps = None
+        else:
+            self._timestamps = np.memmap(
+                self.filename, dtype=np.uint32, mode="r+", shape=(size,)
+            )
+
+    def add(self, block_numbers, timestamps, persist=True):
+        # Record the timestamps of blocks that are not in the index yet, growing the file
+        # (with zeros) up to the highest block number
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.uint32)
+        if len(block_numbers) == 0:
+            return
+
+        with self._lock:
+            if not persist:
+                self._unconfirmed.update(
+                    zip(block_numbers.tolist(), timestamps.tolist())
+                )
+                return
+
+            size = int(block_numbers.max()) + 1
+            if size > len(self):
+                if self._timestamps is not None:
+                    self._timestamps.flush()
+                with open(self.filename, "r+b") as f:
+                    f.truncate(size * 4)
+                self._map()
+
+            unknown = self._timestamps[block_numbers] == 0
+            self._timestamps[block_numbers[unknown]] = timestamps[unknown]
+
+    def missing(self, block_numbers):
+        # The distinct blocks among block_numbers whose timestamp is unknown
+        block_numbers = np.unique(np.asarray(block_numbers, dtype=np.int64))
+        return block_numbers[self.get_timestamps(block_numbers).isna()]
+
+    def get_timestamps(self, block_numbers):
+        # Timestamp of each block as a nullable integer array, <NA> where unknown
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        timestamps = np.zeros(len(block_numbers), dtype=np.int64)
+        with self._lock:
+            if self._timestamps is not None:
+                in_index = (block_numbers >= 0) & (block_numbers < len(self))
+                timestamps[in_index] = self._timestamps[block_numbers[in_index]]
+            if self._unconfirmed:
+                for i in np.flatnonzero(timestamps == 0):
+                    timestamps[i] = self._unconfirmed.get(int(block_numbers[i]), 0)
+        result = pd.array(timestamps, dtype="Int64")
+        result[timestamps == 0] = pd.NA
+        return result
+
+    def flush(self):
+        with self._lock:
+            if self._timestamps is not None:
+                self._timestamps.flush()
@@ -1,4 +1,5 @@
-import requests
+from utils.http_client import alchemy_client
+from utils.rate_limiter import ALCHEMY_COMPUTE_UNITS
 
 
 def check_contract_support(alchemy_api_key, contract_address):
@@ -10,7 +11,9 @@ def check_contract_support(alchemy_api_key, contract_address):
     headers = {
         "Accept": "application/json",
     }
-    r = requests.get(alchemy_url, headers=headers)
+    r = alchemy_client.get(
+        alchemy_url, headers=headers, cost=ALCHEMY_COMPUTE_UNITS["getNFTMetadata"]
+    )
     j = r.json()
     contract_check = j["id"]["tokenMetadata"]["tokenType"]
 
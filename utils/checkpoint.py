@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+CHECKPOINT_ROOT = "./checkpoints"
+
+
+class RunCheckpoint(object):
+    def __init__(self, contract_address, start_block, end_block, root=CHECKPOINT_ROOT):
+        """Progress of one export run of a contract, persisted so that a failed run can be resumed.
+        Holds the run's intermediate files, the stages that completed and the last page
+        committed by each paginated job. A checkpoint left behind by a run from the same
+        start block is resumed, including its end block; otherwise a new run is started
+        """
+        self.directory = os.path.join(root, contract_address)
+        self._state_file = os.path.join(self.directory, "state.json")
+        self._lock = threading.Lock()
+
+        state = None
+        if os.path.isfile(self._state_file):
+            with open(self._state_file) as f:
+                state = json.load(f)
+
+        self.resumed = state is not None and state["start_block"] == start_block
+        if not self.resumed:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            state = dict(
+                run_id=str(datetime.now().timestamp()),
+                start_block=start_block,
+                end_block=end_block,
+                stages=[],
+                jobs={},
+            )
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._state = state
+        self.run_id = state["run_id"]
+        self.start_block = state["start_block"]
+        self.end_block = state["end_block"]
+        self._save()
+
+    @staticmethod
+    def exists(contract_address, root=CHECKPOINT_ROOT):
+        return os.path.isfile(os.path.join(root, contract_address, "state.json"))
+
+    def _save(self):
+        # Write the state atomically so that a crash never leaves a truncated file
+        with open(self._state_file + ".tmp", "w") as f:
+            json.dump(self._state, f)
+        os.replace(self._state_file + ".tmp", self._state_file)
+
+    def path(self, filename):
+        # Intermediate files of the run live next to the checkpoint until it completes
+        return os.path.join(self.directory, filename)
+
+    def is_done(self, stage):
+        return stage in self._state["stages"]
+
+    def mark_done(self, stage):
+        with self._lock:
+            if stage not in self._state["stages"]:
+                self._state["stages"].append(stage)
+            self._save()
+
+    def job(self, key, **params):
+        # Page checkpoint of one paginated job. A job whose parameters (e.g. its block
+        # range) differ from the stored ones starts over.
+        with self._lock:
+            state = self._state["jobs"].get(key)
+            if state is None or state["params"] != params:
+                state = dict(params=params, cursor=None, offsets={}, done=False)
+                self._state["jobs"][key] = state
+                self._save()
+        return PageCheckpoint(self, state)
+
+    def commit_job(self, state, cursor, offsets):
+        with self._lock:
+            state["cursor"] = cursor
+            state["offsets"] = offsets
+            state["done"] = not cursor
+            self._save()
+
+    def clear(self):
+        # The run completed, so its intermediate files are no longer needed
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class PageCheckpoint(object):
+    def __init__(self, run=None, state=None):
+        """Last page committed by a paginated job, with the size of its output files at
+        that point. Without a run checkpoint nothing is persisted and jobs start over
+        """
+        self._run = run
+        self._state = state or dict(cursor=None, offsets={}, done=False)
+        self._files = {}
+
+    @property
+    def cursor(self):
+        return self._state["cursor"]
+
+    @property
+    def done(self):
+        return self._state["done"]
+
+    @property
+    def resumed(self):
+        return len(self._state["offsets"]) > 0
+
+    def open_output(self, output):
+        # Reopen an output at its committed size, dropping rows of a page that was
+        # written but never committed, or start a new file
+        offset = self._state["offsets"].get(output)
+        if offset is not None and not os.path.isfile(output):
+            # The committed rows are gone, so the job has to start over
+            self._state.update(cursor=None, offsets={}, done=False)
+            offset = None
+
+        if offset is None:
+            output_file = open(output, "w", newline="")
+        else:
+            output_file = open(output, "r+", newline="")
+            output_file.truncate(offset)
+            output_file.seek(offset)
+        self._files[output] = output_file
+        return output_file
+
+    def commit(self, cursor):
+        # Flush the outputs, then record the cursor of the next page to fetch
+        if self._run is None:
+            return
+        offsets = {}
+        for output, output_file in self._files.items():
+            output_file.flush()
+            os.fsync(output_file.fileno())
+            offsets[output] = output_file.tell()
+        self._run.commit_job(self._state, cursor, offsets)
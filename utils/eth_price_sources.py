@@ -0,0 +1,111 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, time, timedelta, timezone
+
+import pandas as pd
+
+from utils.http_client import coingecko_client
+
+COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
+
+# CoinGecko returns hourly prices for ranges of up to 90 days, so that the first price
+# of each day is at most an hour after midnight
+MAX_DAYS_PER_RANGE_REQUEST = 90
+
+
+def utc_midnight(date):
+    return datetime.combine(date, time(), tzinfo=timezone.utc)
+
+
+def price_frame(dates, prices):
+    return pd.DataFrame({"date": list(dates), "price_of_eth": list(prices)})
+
+
+class EthPriceSource(ABC):
+    """Source of daily ETH/USD prices. The price of a date is the price at 00:00 UTC that day"""
+
+    @abstractmethod
+    def get_prices(self, dates):
+        # Return a frame with the date (YYYY-MM-DD) and price_of_eth of each date the
+        # source has a price for; dates it does not know are left out
+        pass
+
+
+class CoinGeckoRangePriceSource(EthPriceSource):
+    """Prices of whole date ranges from CoinGecko's market chart range endpoint, one
+    request per MAX_DAYS_PER_RANGE_REQUEST days, resampled to the first price of each day
+    """
+
+    def get_prices(self, dates):
+        dates = sorted(dates)
+        frames = []
+        for i in range(0, len(dates), MAX_DAYS_PER_RANGE_REQUEST):
+            window = dates[i : i + MAX_DAYS_PER_RANGE_REQUEST]
+            frames.append(self._get_range(window[0], window[-1]))
+
+        prices = pd.concat(frames, ignore_index=True)
+        return prices[prices["date"].isin([d.strftime("%Y-%m-%d") for d in dates])]
+
+    def _get_range(self, first_date, last_date):
+        start = utc_midnight(first_date)
+        end = min(
+            utc_midnight(last_date) + timedelta(hours=1), datetime.now(timezone.utc)
+        )
+
+        # Keep the first price at or after midnight of each day, matching the daily
+        # snapshot of the history endpoint
+        daily = self.get_price_points(start, end).resample("D").first().dropna()
+        return price_frame(daily.index.strftime("%Y-%m-%d"), daily.to_numpy())
+
+    def get_price_points(self, start, end):
+        # All prices between two UTC datetimes as a series indexed by their time (UTC)
+        url = (
+            COINGECKO_API_URL
+            + "/coins/ethereum/market_chart/range?vs_currency=usd&from={}&to={}".format(
+                int(start.timestamp()), int(end.timestamp())
+            )
+        )
+
+        # Calls are paced by the shared CoinGecko rate limiter
+        r = coingecko_client.get(url, timeout=90)
+        points = r.json()["prices"]
+        return pd.Series(
+            [price for _, price in points],
+            index=pd.to_datetime([timestamp for timestamp, _ in points], unit="ms"),
+            dtype=float,
+        ).sort_index()
+
+
+class CoinGeckoHistoryPriceSource(EthPriceSource):
+    """Prices from CoinGecko's history endpoint, one request per date"""
+
+    def get_prices(self, dates):
+        rows = []
+        for date in sorted(dates):
+            # CoinGecko API Request
+            url = COINGECKO_API_URL + "/coins/ethereum/history?date={}".format(
+                date.strftime("%d-%m-%Y")
+            )
+
+            # Calls are paced by the shared CoinGecko rate limiter
+            r = coingecko_client.get(url, timeout=90)
+            j = r.json()
+            rows.append(
+                (date.strftime("%Y-%m-%d"), j["market_data"]["current_price"]["usd"])
+            )
+
+        return price_frame([d for d, _ in rows], [p for _, p in rows])
+
+
+class CsvPriceSource(EthPriceSource):
+    """Prices from a local file with date and price_of_eth columns, e.g. for runs
+    without access to CoinGecko
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def get_prices(self, dates):
+        prices = pd.read_csv(self.filename, usecols=["date", "price_of_eth"])
+        prices["date"] = pd.to_datetime(prices["date"]).dt.strftime("%Y-%m-%d")
+        prices = prices.drop_duplicates(subset="date", keep="last")
+        return prices[prices["date"].isin([d.strftime("%Y-%m-%d") for d in dates])]
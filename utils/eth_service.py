@@ -1,6 +1,19 @@
 import itertools
 from datetime import datetime, timezone
 
+from utils.block_timestamp_cache import BlockTimestampCache, SortedPointCache
+from utils.json_rpc import get_block_timestamps
+
+# Blocks closer than this to the chain head may still be reorganized, so their
+# timestamps are only cached in memory
+CONFIRMATIONS = 64
+
+# Block time since the merge, used to estimate where the next boundary block is
+SECONDS_PER_BLOCK = 12
+
+# Number of blocks fetched per batched request when filling the block timestamp index
+BLOCK_TIMESTAMP_BATCH_SIZE = 100
+
 
 def pairwise(iterable):
     """s -> (s0,s1), (s1,s2), (s2, s3), ..."""
@@ -10,22 +23,97 @@ def pairwise(iterable):
 
 
 class GraphOperations(object):
-    def __init__(self, graph):
-        """x axis on the graph must be integers, y value must increase strictly monotonically with increase of x"""
+    def __init__(self, graph, batch_size=1, point_cache=None, point_index=None):
+        """x axis on the graph must be integers, y value must increase strictly monotonically with increase of x.
+        With batch_size > 1 the search evaluates batch_size candidate points per round trip (k-ary search).
+        Points are also recorded in point_index, if given, in memory only near the chain head
+        """
         self._graph = graph
-        self._cached_points = []
+        self._batch_size = batch_size
+        self._cached_points = (
+            point_cache if point_cache is not None else SortedPointCache()
+        )
+        self._point_index = point_index
+        self._last_x = None
 
     def get_bounds_for_y_coordinate(self, y):
         """given the y coordinate, outputs a pair of x coordinates for closest points that bound the y coordinate.
         Left and right bounds are equal in case given y is equal to one of the points y coordinate
         """
-        initial_bounds = find_best_bounds(y, self._cached_points)
-        if initial_bounds is None:
+        initial_bounds = self._cached_points.find_bounds(y)
+        if initial_bounds is not None:
+            initial_bounds = tuple(Point(x, point_y) for x, point_y in initial_bounds)
+        else:
             initial_bounds = self._get_first_point(), self._get_last_point()
 
         result = self._get_bounds_for_y_coordinate_recursive(y, *initial_bounds)
         return result
 
+    def get_bounds_for_y_coordinates(self, ys, y_per_x):
+        """given increasing y coordinates, outputs the bounds of each of them in one sweep.
+        The search for each y starts from the bounds of the previous one and probes around the x
+        estimated with the y_per_x slope (afterwards, the slope between the last two results),
+        which usually brackets y in a single round trip
+        """
+        results = []
+        previous = None
+        last = self._get_last_point()
+        for y in ys:
+            if previous is None:
+                bounds = self.get_bounds_for_y_coordinate(y)
+            else:
+                bounds = self._get_bounds_from_point(y, previous, last, y_per_x)
+            results.append(bounds)
+
+            # Both bounds were probed, so the cache holds the lower bound's y
+            point = Point(*self._cached_points.find_bounds(y)[0])
+            if previous is not None and point.x > previous.x:
+                y_per_x = (point.y - previous.y) / (point.x - previous.x)
+            previous = point
+        return results
+
+    def _get_bounds_from_point(self, y, start, last, y_per_x):
+        if y > last.y:
+            raise OutOfBoundsError(
+                "y coordinate {} is out of bounds for points {}-{}".format(
+                    y, start, last
+                )
+            )
+        if y <= start.y:
+            return self.get_bounds_for_y_coordinate(y)
+
+        # Points probed earlier may already bound y closely
+        end = last
+        cached_bounds = self._cached_points.find_bounds(y)
+        if cached_bounds is not None:
+            lower, upper = (Point(x, point_y) for x, point_y in cached_bounds)
+            if upper.x - lower.x <= 1:
+                return self._get_bounds_for_y_coordinate_recursive(y, lower, upper)
+            start = lower if lower.x > start.x else start
+            end = upper
+
+        # Probe a run of consecutive blocks around the estimate, which brackets y in
+        # a single round trip when the estimate is off by less than half the batch
+        num_probes = self._batch_size
+        estimation_x = start.x + max(int(round((y - start.y) / y_per_x)), 1)
+        first_x = estimation_x - (num_probes - 1) // 2
+        xs = sorted(
+            {
+                min(max(x, start.x + 1), end.x)
+                for x in range(first_x, first_x + num_probes)
+            }
+        )
+
+        # Otherwise, the interpolation search continues between the closest probes
+        for point in self._get_points(xs):
+            if point.y < y:
+                if point.x > start.x:
+                    start = point
+            elif point.x < end.x:
+                end = point
+
+        return self._get_bounds_for_y_coordinate_recursive(y, start, end)
+
     def _get_bounds_for_y_coordinate_recursive(self, y, start, end):
         if y < start.y or y > end.y:
             raise OutOfBoundsError(
@@ -45,36 +133,42 @@ class GraphOperations(object):
             if start.y >= end.y:
                 raise ValueError("y must increase strictly monotonically")
 
-            # Interpolation Search https://en.wikipedia.org/wiki/Interpolation_search, O(log(log(n)) average case.
-            # Improvements for worst case:
-            # Find the 1st estimation by linear interpolation from start and end points.
-            # If the 1st estimation is below the needed y coordinate (graph is concave),
-            # drop the next estimation by interpolating with the start and 1st estimation point
-            # (likely will be above the needed y).
-            # If 1st estimation is above the needed y coordinate (graph is convex),
-            # drop the next estimation by interpolating with the 1st estimation and end point
-            # (likely will be below the needed y).
-
-            estimation1_x = interpolate(start, end, y)
-            estimation1_x = bound(estimation1_x, (start.x, end.x))
-            estimation1 = self._get_point(estimation1_x)
-
-            if estimation1.y < y:
-                points = (start, estimation1)
+            if self._batch_size > 1:
+                # k-ary search: evaluate the interpolation estimate and points spread
+                # geometrically around it in a single batch, then recurse on the best bounds
+                estimations_x = batch_estimations(start, end, y, self._batch_size)
+                all_points = [start, end] + self._get_points(estimations_x)
             else:
-                points = (estimation1, end)
-
-            estimation2_x = interpolate(*points, y)
-            estimation2_x = bound(estimation2_x, (start.x, end.x))
-            estimation2 = self._get_point(estimation2_x)
-
-            all_points = [start, estimation1, estimation2, end]
+                # Interpolation Search https://en.wikipedia.org/wiki/Interpolation_search, O(log(log(n)) average case.
+                # Improvements for worst case:
+                # Find the 1st estimation by linear interpolation from start and end points.
+                # If the 1st estimation is below the needed y coordinate (graph is concave),
+                # drop the next estimation by interpolating with the start and 1st estimation point
+                # (likely will be above the needed y).
+                # If 1st estimation is above the needed y coordinate (graph is convex),
+                # drop the next estimation by interpolating with the 1st estimation and end point
+                # (likely will be below the needed y).
+
+                estimation1_x = interpolate(start, end, y)
+                estimation1_x = bound(estimation1_x, (start.x, end.x))
+                estimation1 = self._get_point(estimation1_x)
+
+                if estimation1.y < y:
+                    points = (start, estimation1)
+                else:
+                    points = (estimation1, end)
+
+                estimation2_x = interpolate(*points, y)
+                estimation2_x = bound(estimation2_x, (start.x, end.x))
+                estimation2 = self._get_point(estimation2_x)
+
+                all_points = [start, estimation1, estimation2, end]
 
             bounds = find_best_bounds(y, all_points)
             if bounds is None:
                 raise ValueError(
                     "Unable to find bounds for points {} and y coordinate {}".format(
-                        points, y
+                        all_points, y
                     )
                 )
 
@@ -82,19 +176,36 @@ class GraphOperations(object):
 
     def _get_point(self, x):
         point = self._graph.get_point(x)
-        self._cached_points.append(point)
+        self._cache_point(point)
         return point
 
+    def _get_points(self, xs):
+        points = self._graph.get_points(xs)
+        for point in points:
+            self._cache_point(point)
+        return points
+
     def _get_first_point(self):
         point = self._graph.get_first_point()
-        self._cached_points.append(point)
+        self._cache_point(point)
         return point
 
     def _get_last_point(self):
         point = self._graph.get_last_point()
-        self._cached_points.append(point)
+        self._last_x = point.x
+        self._cache_point(point)
         return point
 
+    def _cache_point(self, point):
+        # Points near the chain head are kept in memory only
+        persist = self._last_x is None or point.x <= self._last_x - CONFIRMATIONS
+        self._cached_points.add(point.x, point.y, persist=persist)
+        if self._point_index is not None:
+            self._point_index.add([point.x], [point.y], persist=persist)
+
+    def flush_cache(self):
+        self._cached_points.flush()
+
 
 def find_best_bounds(y, points):
     sorted_points = sorted(points, key=lambda point: point.y)
@@ -104,6 +215,28 @@ def find_best_bounds(y, points):
     return None
 
 
+def batch_estimations(start, end, y, batch_size):
+    # Small gaps are resolved in one round by probing every block in between
+    if end.x - start.x - 1 <= batch_size:
+        return list(range(start.x + 1, end.x))
+
+    # Otherwise probe the interpolation estimate plus points at geometrically growing
+    # offsets on either side of it (from 1 block up to a quarter of the gap), so that
+    # the batch brackets y tightly whether the interpolation error is small or large
+    estimation_x = bound(interpolate(start, end, y), (start.x, end.x))
+    num_offsets = (batch_size - 1) // 2
+    max_offset = max((end.x - start.x) // 4, 1)
+    ratio = max_offset ** (1 / max(num_offsets - 1, 1))
+
+    candidates = [estimation_x]
+    for i in range(num_offsets):
+        offset = max(int(ratio**i), 1)
+        candidates.append(bound(estimation_x - offset, (start.x, end.x)))
+        candidates.append(bound(estimation_x + offset, (start.x, end.x)))
+
+    return sorted(set(candidates))[:batch_size]
+
+
 def interpolate(point1, point2, y):
     x1, y1 = point1.x, point1.y
     x2, y2 = point2.x, point2.y
@@ -144,9 +277,47 @@ class Point(object):
 
 
 class EthService(object):
-    def __init__(self, web3):
-        graph = BlockTimestampGraph(web3)
-        self._graph_operations = GraphOperations(graph)
+    def __init__(
+        self, web3, rpc=None, batch_size=1, cache_file=None, timestamp_index=None
+    ):
+        # Pass a JsonRpcBatchClient as rpc to probe batch_size blocks per round trip,
+        # a cache_file to reuse block timestamps probed in earlier runs, and a
+        # BlockTimestampIndex to record the timestamp of every block fetched
+        self._graph = BlockTimestampGraph(web3, rpc)
+        self.timestamp_index = timestamp_index
+        point_cache = BlockTimestampCache(cache_file) if cache_file else None
+        self._graph_operations = GraphOperations(
+            self._graph,
+            batch_size=batch_size if rpc is not None else 1,
+            point_cache=point_cache,
+            point_index=timestamp_index,
+        )
+
+    def fill_block_timestamps(self, block_numbers):
+        # Fetch the blocks missing from the timestamp index in batched requests and
+        # record their timestamps. Blocks within CONFIRMATIONS of the chain head may
+        # still be reorged, so they are not written to the index file.
+        missing = self.timestamp_index.missing(block_numbers)
+        if len(missing) == 0:
+            return 0
+
+        last_confirmed_x = self._graph.get_last_point().x - CONFIRMATIONS
+        for i in range(0, len(missing), BLOCK_TIMESTAMP_BATCH_SIZE):
+            points = self._graph.get_points(
+                [int(x) for x in missing[i : i + BLOCK_TIMESTAMP_BATCH_SIZE]]
+            )
+            confirmed = [point for point in points if point.x <= last_confirmed_x]
+            unconfirmed = [point for point in points if point.x > last_confirmed_x]
+            self.timestamp_index.add(
+                [point.x for point in confirmed], [point.y for point in confirmed]
+            )
+            self.timestamp_index.add(
+                [point.x for point in unconfirmed],
+                [point.y for point in unconfirmed],
+                persist=False,
+            )
+        self.timestamp_index.flush()
+        return len(missing)
 
     def get_block_range_for_date(self, date):
         start_datetime = datetime.combine(
@@ -189,6 +360,8 @@ class EthService(object):
         ):
             raise ValueError("The given timestamp range does not cover any blocks")
 
+        self._graph_operations.flush_cache()
+
         start_block = start_block_bounds[1]
         end_block = end_block_bounds[0]
 
@@ -198,10 +371,65 @@ class EthService(object):
 
         return start_block, end_block
 
+    def get_block_ranges_for_dates(self, dates):
+        # Block ranges of several dates, resolving the blocks at all day boundaries in
+        # one sweep instead of two independent searches per date
+        def start_of(date):
+            return int(
+                datetime.combine(
+                    date, datetime.min.time().replace(tzinfo=timezone.utc)
+                ).timestamp()
+            )
+
+        boundaries = {}
+        for date in dates:
+            boundaries[date] = (start_of(date), start_of(date) + 24 * 60 * 60)
+        first_blocks = self.get_first_blocks_for_timestamps(
+            [t for bounds in boundaries.values() for t in bounds]
+        )
+        return [
+            self._block_range(first_blocks[start], first_blocks[end])
+            for start, end in (boundaries[date] for date in dates)
+        ]
+
+    def get_block_ranges_for_intervals(self, boundaries):
+        # Block ranges between consecutive timestamps, e.g. the start of every hour
+        # plus the end of the last one
+        first_blocks = self.get_first_blocks_for_timestamps(boundaries)
+        return [
+            self._block_range(first_blocks[int(start)], first_blocks[int(end)])
+            for start, end in pairwise(boundaries)
+        ]
+
+    def get_first_blocks_for_timestamps(self, timestamps):
+        # First block at or after each timestamp, by timestamp
+        timestamps = sorted(set(int(t) for t in timestamps))
+        try:
+            bounds = self._graph_operations.get_bounds_for_y_coordinates(
+                timestamps, SECONDS_PER_BLOCK
+            )
+        except OutOfBoundsError as e:
+            raise OutOfBoundsError(
+                "The existing blocks do not completely cover the given time range"
+            ) from e
+        self._graph_operations.flush_cache()
+        return {t: b[1] for t, b in zip(timestamps, bounds)}
+
+    def _block_range(self, start_block, next_start_block):
+        if next_start_block <= start_block:
+            raise ValueError("The given timestamp range does not cover any blocks")
+
+        # The genesis block has timestamp 0 but we include it with the 1st block.
+        if start_block == 1:
+            start_block = 0
+
+        return start_block, next_start_block - 1
+
 
 class BlockTimestampGraph(object):
-    def __init__(self, web3):
+    def __init__(self, web3, rpc=None):
         self._web3 = web3
+        self._rpc = rpc
 
     def get_first_point(self):
         # Ignore the genesis block as its timestamp is 0
@@ -213,6 +441,11 @@ class BlockTimestampGraph(object):
     def get_point(self, x):
         return block_to_point(self._web3.eth.get_block(x))
 
+    def get_points(self, xs):
+        if self._rpc is None:
+            return [self.get_point(x) for x in xs]
+        return [Point(x, y) for x, y in get_block_timestamps(self._rpc, xs)]
+
 
 def block_to_point(block):
     return Point(block.number, block.timestamp)
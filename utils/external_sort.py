@@ -0,0 +1,83 @@
+import csv
+import heapq
+import os
+import tempfile
+
+# Most run files open at once while merging, well under the usual open file limits
+MAX_MERGE_FAN_IN = 64
+
+
+def numeric_sort_key(header, by, ascending):
+    # Key of a CSV row that orders rows like DataFrame.sort_values on numeric columns,
+    # with empty values last
+    indices = [header.index(column) for column in by]
+    signs = [1 if asc else -1 for asc in ascending]
+
+    def key(row):
+        return tuple(
+            (1, 0.0) if row[i] == "" else (0, sign * float(row[i]))
+            for i, sign in zip(indices, signs)
+        )
+
+    return key
+
+
+def merge_runs(run_files, output, header, key):
+    # Merge sorted run files into one CSV file. Ties keep the order of the runs, and
+    # lines end like the ones written by DataFrame.to_csv.
+    run_handles = [open(f, "r", newline="") for f in run_files]
+    try:
+        readers = []
+        for f in run_handles:
+            reader = csv.reader(f)
+            next(reader)
+            readers.append(reader)
+
+        with open(output, "w", newline="") as output_file:
+            writer = csv.writer(output_file, lineterminator="\n")
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*readers, key=key))
+    finally:
+        for f in run_handles:
+            f.close()
+
+
+def sort_chunks_to_csv(chunks, output, by, ascending):
+    """Sort the rows of a stream of DataFrames with the same columns into one CSV file, by
+    numeric columns, holding only one chunk in memory at a time (external merge sort).
+    Each chunk is sorted and written to a run file, then the runs are merged with heapq.merge,
+    in several passes over groups of at most MAX_MERGE_FAN_IN consecutive runs if needed
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+    with tempfile.TemporaryDirectory(dir=directory) as run_dir:
+        run_files = []
+        header = None
+        for chunk in chunks:
+            header = list(chunk.columns)
+            run_file = os.path.join(run_dir, "run_{}.csv".format(len(run_files)))
+            chunk.sort_values(by=by, ascending=ascending, kind="stable").to_csv(
+                run_file, index=False
+            )
+            run_files.append(run_file)
+
+        if header is None:
+            raise ValueError("No chunks to sort into {}".format(output))
+
+        key = numeric_sort_key(header, by, ascending)
+        merge_pass = 0
+        while len(run_files) > MAX_MERGE_FAN_IN:
+            merged_files = []
+            for i in range(0, len(run_files), MAX_MERGE_FAN_IN):
+                merged_file = os.path.join(
+                    run_dir, "merge_{}_{}.csv".format(merge_pass, len(merged_files))
+                )
+                merge_runs(
+                    run_files[i : i + MAX_MERGE_FAN_IN], merged_file, header, key
+                )
+                merged_files.append(merged_file)
+            for f in run_files:
+                os.remove(f)
+            run_files = merged_files
+            merge_pass += 1
+
+        merge_runs(run_files, output, header, key)
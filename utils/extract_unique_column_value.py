@@ -1,7 +1,16 @@
 import csv
 
+from utils.storage import is_parquet, read_table
+
 
 def extract_unique_column_value(input_filename, output_filename, column):
+    # Parquet inputs are read column-wise instead of row by row
+    if is_parquet(input_filename):
+        values = read_table(input_filename, columns=[column])[column].dropna().unique()
+        with open(output_filename, "w") as f:
+            f.writelines(str(value) + "\n" for value in values)
+        return
+
     # Extract unique values from a column in a CSV file
     with open(input_filename, "r") as input_file, open(
         output_filename, "w"
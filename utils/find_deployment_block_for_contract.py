@@ -1,5 +1,8 @@
+from utils.json_rpc import has_code_at_blocks
+
+
 def find_deployment_block_for_contract(
-    contract_address, web3_interface, latest_block=None
+    contract_address, web3_interface, latest_block=None, rpc=None, batch_size=1
 ):
     # Binary search for the block number in which a contract was deployed
     left = 0
@@ -10,11 +13,24 @@ def find_deployment_block_for_contract(
         if left == right:
             return left
 
-        to_check = (left + right) // 2
-        current_block = web3_interface.eth.get_code(
-            contract_address, block_identifier=to_check
-        )
-        if len(current_block) == 0:
-            left = to_check + 1
+        if rpc is None or batch_size <= 1:
+            to_check = (left + right) // 2
+            current_block = web3_interface.eth.get_code(
+                contract_address, block_identifier=to_check
+            )
+            if len(current_block) == 0:
+                left = to_check + 1
+            else:
+                right = to_check
         else:
-            right = to_check
+            # k-ary search: probe batch_size evenly spaced blocks in one round trip
+            step = (right - left) / (batch_size + 1)
+            blocks_to_check = sorted(
+                set(left + int(step * (i + 1)) for i in range(batch_size))
+            )
+            has_code = has_code_at_blocks(rpc, contract_address, blocks_to_check)
+            for to_check, deployed in zip(blocks_to_check, has_code):
+                if deployed:
+                    right = to_check
+                    break
+                left = to_check + 1
@@ -0,0 +1,82 @@
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.rate_limiter import alchemy_rate_limiter, coingecko_rate_limiter
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def backoff_delay(attempt, base=1.0, maximum=60.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(maximum, base * 2**attempt))
+
+
+def retry_after_seconds(response):
+    # Parse a Retry-After header given in seconds, if present
+    try:
+        return max(float(response.headers["Retry-After"]), 0.0)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class HttpClient(object):
+    def __init__(self, rate_limiter=None, max_retries=5, timeout=90, pool_size=32):
+        """Pooled HTTP client shared by all requests to one provider.
+        Requests are paced by the provider's rate limiter and retried with exponential
+        backoff on connection errors, 429 and 5xx responses
+        """
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        # Reuse keep-alive connections and ask for compressed responses
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+        )
+
+    def get(self, url, cost=1, **kwargs):
+        return self.request("GET", url, cost=cost, **kwargs)
+
+    def post(self, url, cost=1, **kwargs):
+        return self.request("POST", url, cost=cost, **kwargs)
+
+    def request(self, method, url, cost=1, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(cost)
+
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+
+            if r.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return r
+
+            delay = retry_after_seconds(r)
+            if delay is None:
+                delay = backoff_delay(attempt)
+
+            if r.status_code == 429:
+                print("Rate limited by {}. Backing off...".format(r.url.split("/")[2]))
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(delay)
+                    continue
+
+            time.sleep(delay)
+
+
+alchemy_client = HttpClient(rate_limiter=alchemy_rate_limiter)
+coingecko_client = HttpClient(rate_limiter=coingecko_rate_limiter)
@@ -0,0 +1,100 @@
+import itertools
+
+from web3 import HTTPProvider
+
+from utils.http_client import alchemy_client
+
+# Compute unit cost of each JSON-RPC method used in batches
+RPC_COMPUTE_UNITS = {
+    "eth_getBlockByNumber": 16,
+    "eth_getCode": 26,
+}
+
+
+class JsonRpcError(Exception):
+    pass
+
+
+class RateLimitedHTTPProvider(HTTPProvider):
+    def __init__(self, endpoint_uri, http_client=alchemy_client, **kwargs):
+        """web3 provider that sends each call through an HttpClient, so that web3 calls are
+        paced by the provider's rate limiter and retried with backoff like all other requests
+        """
+        super().__init__(endpoint_uri, **kwargs)
+        self._http_client = http_client
+
+    def make_request(self, method, params):
+        r = self._http_client.post(
+            self.endpoint_uri,
+            data=self.encode_rpc_request(method, params),
+            cost=RPC_COMPUTE_UNITS.get(method, 10),
+            **self.get_request_kwargs()
+        )
+        r.raise_for_status()
+        return self.decode_rpc_response(r.content)
+
+
+class JsonRpcBatchClient(object):
+    def __init__(self, endpoint_uri, http_client=alchemy_client):
+        """Sends several JSON-RPC calls to the node in a single HTTP round trip"""
+        self._endpoint_uri = endpoint_uri
+        self._http_client = http_client
+        self._ids = itertools.count(1)
+        self.round_trips = 0
+
+    def batch(self, calls):
+        # calls is a list of (method, params) pairs; results are returned in the same order
+        if len(calls) == 0:
+            return []
+
+        requests = [
+            {
+                "jsonrpc": "2.0",
+                "id": next(self._ids),
+                "method": method,
+                "params": params,
+            }
+            for method, params in calls
+        ]
+        cost = sum(RPC_COMPUTE_UNITS.get(method, 10) for method, _ in calls)
+
+        r = self._http_client.post(self._endpoint_uri, json=requests, cost=cost)
+        self.round_trips += 1
+        responses = r.json()
+        if not isinstance(responses, list):
+            raise JsonRpcError("Unexpected batch response: {}".format(responses))
+
+        # Responses may arrive in any order, so match them to requests by id
+        responses_by_id = {response.get("id"): response for response in responses}
+        results = []
+        for request in requests:
+            response = responses_by_id.get(request["id"])
+            if response is None or "error" in response:
+                raise JsonRpcError(
+                    "{} failed: {}".format(
+                        request["method"], response and response.get("error")
+                    )
+                )
+            results.append(response["result"])
+        return results
+
+
+def get_block_timestamps(rpc, block_numbers):
+    # Fetch (number, timestamp) pairs for several blocks in one round trip
+    blocks = rpc.batch(
+        [("eth_getBlockByNumber", [hex(x), False]) for x in block_numbers]
+    )
+    # A node returns null for blocks past its head, e.g. when it lags behind the others
+    # behind a load balancer
+    for x, block in zip(block_numbers, blocks):
+        if block is None:
+            raise JsonRpcError("eth_getBlockByNumber returned no block {}".format(x))
+    return [(int(block["number"], 16), int(block["timestamp"], 16)) for block in blocks]
+
+
+def has_code_at_blocks(rpc, contract_address, block_numbers):
+    # Check whether a contract has code at several blocks in one round trip
+    codes = rpc.batch(
+        [("eth_getCode", [contract_address, hex(x)]) for x in block_numbers]
+    )
+    return [code not in (None, "0x", "") for code in codes]
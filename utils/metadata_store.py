@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+METADATA_STORE_ROOT = "./metadata-store"
+
+ATTRIBUTE_COLUMNS = ["value", "trait_type", "asset_id"]
+TOKEN_COLUMNS = ["asset_id", "content_hash", "last_fetched"]
+
+
+def content_hashes(attributes_df, token_ids):
+    # Hash each token's attributes independently of their order, so a refetched
+    # token whose metadata did not change keeps the same hash. Tokens without
+    # attributes hash to the empty list.
+    attributes_df = attributes_df.astype(str)
+    pairs = {}
+    for asset_id, trait_type, value in zip(
+        attributes_df["asset_id"], attributes_df["trait_type"], attributes_df["value"]
+    ):
+        pairs.setdefault(asset_id, []).append((trait_type, value))
+
+    return {
+        token_id: hashlib.sha1(
+            json.dumps(sorted(pairs.get(token_id, []))).encode()
+        ).hexdigest()
+        for token_id in token_ids
+    }
+
+
+class MetadataStore(object):
+    def __init__(self, contract_address, root=METADATA_STORE_ROOT):
+        """Per-token metadata of one collection, persisted between runs.
+        Attributes are stored in the raw attributes format read by generate_metadata_output,
+        next to one row per fetched token with the hash of its attributes
+        """
+        directory = os.path.join(root, contract_address)
+        self.attributes_file = os.path.join(directory, "attributes.csv")
+        self.tokens_file = os.path.join(directory, "tokens.csv")
+        self.sweeps_file = os.path.join(directory, "full_sweeps.csv")
+
+    def _read(self, filename, columns):
+        # Everything is kept as text so that rewriting the store preserves values exactly
+        if not os.path.isfile(filename):
+            return pd.DataFrame(columns=columns)
+        return pd.read_csv(filename, dtype=str, keep_default_na=False)
+
+    def _write(self, df, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        df.to_csv(filename + ".tmp", index=False)
+        os.replace(filename + ".tmp", filename)
+
+    def known_token_ids(self):
+        return set(self._read(self.tokens_file, TOKEN_COLUMNS)["asset_id"])
+
+    def needs_full_sweep(self, full_sweep_days=None):
+        # A store that has never been filled by a full sweep always needs one;
+        # afterwards only when the last sweep is older than full_sweep_days
+        sweeps = self._read(self.sweeps_file, ["last_full_sweep"])
+        if len(sweeps) == 0:
+            return True
+        if full_sweep_days is None:
+            return False
+        last_full_sweep = datetime.strptime(
+            sweeps.iloc[-1]["last_full_sweep"], "%Y-%m-%d"
+        )
+        return datetime.now() - last_full_sweep >= timedelta(days=full_sweep_days)
+
+    def update(self, raw_attributes_file, fetched_token_ids, full_sweep=False):
+        """Store the attributes fetched for the given tokens and return how many tokens changed.
+        A full sweep replaces the whole store, otherwise only the fetched tokens are replaced
+        """
+        fetched_token_ids = [str(t) for t in fetched_token_ids]
+        fetched = self._read(raw_attributes_file, ATTRIBUTE_COLUMNS)
+        fetched = fetched[fetched["asset_id"].isin(fetched_token_ids)]
+        new_hashes = content_hashes(fetched, fetched_token_ids)
+
+        tokens = self._read(self.tokens_file, TOKEN_COLUMNS)
+        old_hashes = dict(zip(tokens["asset_id"], tokens["content_hash"]))
+        changed = [t for t in fetched_token_ids if old_hashes.get(t) != new_hashes[t]]
+
+        if full_sweep:
+            attributes = fetched
+            tokens = tokens.iloc[0:0]
+        elif len(changed) > 0:
+            attributes = self._read(self.attributes_file, ATTRIBUTE_COLUMNS)
+            attributes = attributes[~attributes["asset_id"].isin(changed)]
+            attributes = pd.concat(
+                [attributes, fetched[fetched["asset_id"].isin(changed)]],
+                ignore_index=True,
+            )
+        else:
+            attributes = None
+
+        if attributes is not None:
+            self._write(attributes[ATTRIBUTE_COLUMNS], self.attributes_file)
+
+        # Record when each fetched token was last seen, whether or not it changed
+        last_fetched = datetime.now().strftime("%Y-%m-%d")
+        tokens = tokens[~tokens["asset_id"].isin(fetched_token_ids)]
+        tokens = pd.concat(
+            [
+                tokens,
+                pd.DataFrame(
+                    {
+                        "asset_id": fetched_token_ids,
+                        "content_hash": [new_hashes[t] for t in fetched_token_ids],
+                        "last_fetched": last_fetched,
+                    }
+                ),
+            ],
+            ignore_index=True,
+        )
+        self._write(tokens[TOKEN_COLUMNS], self.tokens_file)
+
+        if full_sweep:
+            sweeps = self._read(self.sweeps_file, ["last_full_sweep"])
+            sweeps = pd.concat(
+                [sweeps, pd.DataFrame({"last_full_sweep": [last_fetched]})],
+                ignore_index=True,
+            )
+            self._write(sweeps, self.sweeps_file)
+
+        return len(changed)
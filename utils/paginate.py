@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+
+from utils.http_client import backoff_delay
+
+
+class PaginationStats(object):
+    def __init__(self, label):
+        self.label = label
+        self.fetch_seconds = []
+        self.process_seconds = []
+        self.wait_seconds = 0.0
+
+    def summary(self):
+        num_pages = len(self.fetch_seconds)
+        if num_pages == 0:
+            return "{}: no pages fetched".format(self.label)
+        return (
+            "{}: {} pages, fetch {:.2f}s (avg {:.3f}s/page), "
+            "process {:.2f}s (avg {:.3f}s/page), waited on network {:.2f}s".format(
+                self.label,
+                num_pages,
+                sum(self.fetch_seconds),
+                sum(self.fetch_seconds) / num_pages,
+                sum(self.process_seconds),
+                sum(self.process_seconds) / max(len(self.process_seconds), 1),
+                self.wait_seconds,
+            )
+        )
+
+
+def fetch_with_retries(fetch, retries=3):
+    # Sometimes requests can randomly fail. Retry 3 times before timing out.
+    # fetch is expected to raise a KeyError when the response is malformed.
+    # Throttling and connection errors are already retried by the HTTP client.
+    for i in range(retries):
+        try:
+            return fetch()
+        except KeyError:
+            if i < retries - 1:
+                print("Alchemy request failed. Retrying request...")
+                time.sleep(backoff_delay(i, base=2.0))
+                continue
+            else:
+                raise
+
+
+def paginate(
+    fetch_page, get_next_cursor, prefetch_depth=2, label="Pages", start_cursor=None
+):
+    # Yield pages returned by fetch_page(cursor) until get_next_cursor(page) returns no cursor.
+    # Paging starts from start_cursor, e.g. the cursor committed by an interrupted run.
+    # Pages are fetched on a background thread and buffered in a bounded queue, so the
+    # next request is in flight while the caller is decoding and writing the current one.
+    stats = PaginationStats(label)
+    pages = queue.Queue(maxsize=max(prefetch_depth, 1))
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        cursor = start_cursor
+        try:
+            while True:
+                fetch_start = time.perf_counter()
+                page = fetch_page(cursor)
+                stats.fetch_seconds.append(time.perf_counter() - fetch_start)
+                cursor = get_next_cursor(page)
+
+                if not put(page) or not cursor:
+                    break
+        except BaseException as e:
+            put(e)
+            return
+        put(finished)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            item = pages.get()
+            stats.wait_seconds += time.perf_counter() - wait_start
+
+            if item is finished:
+                break
+            if isinstance(item, BaseException):
+                raise item
+
+            process_start = time.perf_counter()
+            yield item
+            stats.process_seconds.append(time.perf_counter() - process_start)
+    finally:
+        stopped.set()
+        producer.join()
+        print(stats.summary())
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    def __init__(self, rate, capacity=None):
+        """Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens.
+        Safe to share between threads, so a single limiter enforces a global budget
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate, capacity=None):
+        with self._lock:
+            self.rate = float(rate)
+            self.capacity = float(capacity if capacity is not None else rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def pause(self, seconds):
+        # Drain the bucket so that every thread sharing this limiter backs off,
+        # e.g. after the provider responded with 429 Too Many Requests
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def acquire(self, tokens=1):
+        # Block until the requested number of tokens is available, then consume them
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._last_refill) * self.rate
+                )
+                self._last_refill = now
+
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Alchemy's free tier allows 330 compute units per second across all requests
+alchemy_rate_limiter = RateLimiter(rate=330)
+
+# CoinGecko's public API allows roughly 10 calls per minute
+coingecko_rate_limiter = RateLimiter(rate=10 / 60, capacity=1)
+
+# Compute unit cost of each Alchemy method used by the jobs
+ALCHEMY_COMPUTE_UNITS = {
+    "alchemy_getAssetTransfers": 150,
+    "getNFTSales": 180,
+    "getNFTsForCollection": 100,
+    "getNFTMetadata": 80,
+    "getNFTMetadataBatch": 600,
+}
@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StageGraph(object):
+    def __init__(self, max_workers=None):
+        """Named stages with the stages they depend on. Running the graph starts every stage
+        as soon as its dependencies completed, so independent stages run concurrently
+        """
+        self._max_workers = max_workers
+        self._stages = {}
+        self.results = {}
+        self.timings = {}
+
+    def add(self, name, run, depends_on=()):
+        # Dependencies must be added first, which keeps the graph acyclic
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(
+                    "Stage {} depends on unknown stage {}".format(name, dependency)
+                )
+        if name in self._stages:
+            raise ValueError("Stage {} was added twice".format(name))
+        self._stages[name] = (run, list(depends_on))
+
+    def run(self):
+        # Run all stages and return their results by name. When a stage fails, stages
+        # that already started are awaited, no new stages start and the error is raised.
+        graph_start = time.perf_counter()
+        pending = dict(self._stages)
+        running = {}
+        error = None
+
+        def timed(name, run):
+            start = time.perf_counter() - graph_start
+            try:
+                return run()
+            finally:
+                self.timings[name] = (start, time.perf_counter() - graph_start)
+
+        with ThreadPoolExecutor(
+            max_workers=self._max_workers or max(len(pending), 1)
+        ) as executor:
+            while pending or running:
+                if error is None:
+                    for name, (run, depends_on) in list(pending.items()):
+                        if all(d in self.results for d in depends_on):
+                            running[executor.submit(timed, name, run)] = name
+                            del pending[name]
+                else:
+                    pending.clear()
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+
+        if error is not None:
+            raise error
+        return self.results
+
+    def critical_path(self):
+        # Follow the dependency that finished last back from the last stage to finish;
+        # these stages bound the wall-clock time of the graph
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            depends_on = [d for d in self._stages[name][1] if d in self.timings]
+            if not depends_on:
+                break
+            name = max(depends_on, key=lambda d: self.timings[d][1])
+            path.append(name)
+        return path[::-1]
+
+    def timing_summary(self):
+        lines = ["Stage timings:"]
+        width = max([len(name) for name in self.timings] + [0])
+        for name, (start, end) in sorted(self.timings.items(), key=lambda t: t[1]):
+            lines.append(
+                "  {:<{}} {:>8.1f}s -> {:>8.1f}s  ({:.1f}s)".format(
+                    name, width, start, end, end - start
+                )
+            )
+        path = self.critical_path()
+        if path:
+            lines.append(
+                "Critical path ({:.1f}s): {}".format(
+                    self.timings[path[-1]][1],
+                    " -> ".join(
+                        "{} ({:.1f}s)".format(
+                            n, self.timings[n][1] - self.timings[n][0]
+                        )
+                        for n in path
+                    ),
+                )
+            )
+        return "\n".join(lines)
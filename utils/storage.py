@@ -0,0 +1,215 @@
+import glob
+import importlib.util
+import os
+
+import pandas as pd
+
+DATASET_ROOT = "./datasets"
+
+# Repeated address and hash strings are dictionary-encoded in Parquet files
+DICTIONARY_COLUMNS = [
+    "transaction_hash",
+    "from_address",
+    "to_address",
+    "seller",
+    "buyer",
+    "maker",
+    "taker",
+    "marketplace",
+    "date",
+]
+
+
+def require_pyarrow():
+    # pyarrow is an optional dependency that is only needed for Parquet storage
+    if importlib.util.find_spec("pyarrow") is None:
+        raise Exception(
+            "Parquet storage requires pyarrow. Install it with `pip3 install pyarrow` "
+            "or `poetry install --extras parquet`."
+        )
+
+
+def is_parquet(path):
+    return path.endswith(".parquet") or os.path.isdir(path)
+
+
+def read_table(path, columns=None):
+    # Read a CSV file, a Parquet file, or a partitioned Parquet dataset directory
+    if is_parquet(path):
+        require_pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def write_parquet(df, path):
+    require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(
+        table,
+        path + ".tmp",
+        compression="zstd",
+        use_dictionary=[c for c in DICTIONARY_COLUMNS if c in df.columns],
+    )
+    os.replace(path + ".tmp", path)
+
+
+def write_table(df, path):
+    # Write a DataFrame as Parquet or CSV depending on the file extension
+    if is_parquet(path):
+        write_parquet(df, path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def dataset_path(kind, contract_address, root=DATASET_ROOT):
+    return os.path.join(root, kind, "contract=" + contract_address)
+
+
+def partition_files(kind, contract_address, root=DATASET_ROOT):
+    # Monthly partition files of a contract's dataset, oldest first
+    return sorted(
+        glob.glob(
+            os.path.join(
+                dataset_path(kind, contract_address, root), "month=*", "*.parquet"
+            )
+        )
+    )
+
+
+def drop_from_dataset(kind, contract_address, from_block, root=DATASET_ROOT):
+    # Remove the rows at or above from_block from a contract's dataset. They are in the
+    # most recent partitions, so scan backwards until a partition lies entirely below
+    # from_block; only the affected partitions are rewritten.
+    require_pyarrow()
+    import pyarrow.parquet as pq
+
+    for partition_file in reversed(partition_files(kind, contract_address, root)):
+        month = os.path.basename(os.path.dirname(partition_file))[len("month=") :]
+        block_numbers = (
+            pq.read_table(partition_file, columns=["block_number"])
+            .column("block_number")
+            .to_pandas()
+        )
+        if block_numbers.empty or block_numbers.max() < from_block:
+            if month != "unknown":
+                break
+            continue
+
+        partition_df = pd.read_parquet(partition_file)
+        partition_df = partition_df[partition_df["block_number"] < from_block]
+        if partition_df.empty:
+            os.remove(partition_file)
+        else:
+            write_parquet(partition_df, partition_file)
+
+
+def add_to_dataset(delta_df, kind, contract_address, root=DATASET_ROOT):
+    # Merge rows into a contract's dataset partitioned by month, after the rows already
+    # there for the same blocks, so that a delta can be added one chunk at a time
+    require_pyarrow()
+
+    months = delta_df["date"].fillna("unknown").astype(str).str[:7]
+    for month, month_delta_df in delta_df.groupby(months):
+        partition_file = os.path.join(
+            dataset_path(kind, contract_address, root), "month=" + month, "part.parquet"
+        )
+        frames = [month_delta_df]
+        if os.path.isfile(partition_file):
+            frames.insert(0, pd.read_parquet(partition_file))
+
+        month_df = pd.concat(frames, ignore_index=True).sort_values(
+            by=["block_number"], ascending=False, kind="stable"
+        )
+        write_parquet(month_df, partition_file)
+
+
+def append_to_dataset(
+    delta_df, kind, contract_address, from_block=None, root=DATASET_ROOT
+):
+    # Add new rows to a contract's dataset partitioned by month. Existing rows at or above
+    # from_block are superseded by the delta.
+    if from_block is None and not delta_df.empty:
+        from_block = delta_df["block_number"].min()
+
+    if from_block is not None:
+        drop_from_dataset(kind, contract_address, from_block, root)
+    add_to_dataset(delta_df, kind, contract_address, root)
+
+
+def seed_dataset_from_csv(
+    kind, contract_address, csv_file, chunksize, root=DATASET_ROOT
+):
+    # A collection exported as CSV before switching to Parquet storage keeps its history:
+    # an empty dataset is filled with the rows of the existing consolidated CSV first,
+    # chunksize rows at a time
+    if len(partition_files(kind, contract_address, root)) > 0:
+        return False
+    if not os.path.isfile(csv_file):
+        return False
+
+    with pd.read_csv(csv_file, chunksize=chunksize) as reader:
+        for chunk in reader:
+            add_to_dataset(chunk, kind, contract_address, root)
+    return len(partition_files(kind, contract_address, root)) > 0
+
+
+def render_dataset_to_csv(
+    kind, contract_address, output, columns=None, root=DATASET_ROOT
+):
+    # Render a contract's dataset to a single CSV sorted by descending block number,
+    # one monthly partition at a time
+    require_pyarrow()
+    import pyarrow.parquet as pq
+
+    files = partition_files(kind, contract_address, root)
+
+    # Partitions written before a column was added lack it, so every partition is
+    # aligned to the columns of all of them, with empty values where one is missing
+    output_columns = list(columns) if columns is not None else []
+    for partition_file in files:
+        for name in pq.read_schema(partition_file).names:
+            if name not in output_columns:
+                output_columns.append(name)
+    dated_files = [f for f in reversed(files) if "month=unknown" not in f]
+    undated_df = pd.concat(
+        [pd.read_parquet(f) for f in files if "month=unknown" in f] + [pd.DataFrame()],
+        ignore_index=True,
+    )
+
+    with open(output, "w", newline="") as output_file:
+        if len(files) == 0:
+            pd.DataFrame(columns=columns).to_csv(output_file, index=False)
+            return
+
+        header = True
+        for partition_file in dated_files:
+            partition_df = pd.read_parquet(partition_file)
+
+            # Slot rows without a date in next to the partition covering their block
+            if not undated_df.empty:
+                is_newer = (
+                    undated_df["block_number"] >= partition_df["block_number"].min()
+                )
+                partition_df = pd.concat(
+                    [undated_df[is_newer], partition_df], ignore_index=True
+                ).sort_values(by=["block_number"], ascending=False, kind="stable")
+                undated_df = undated_df[~is_newer]
+
+            partition_df.reindex(columns=output_columns).to_csv(
+                output_file, header=header, index=False
+            )
+            header = False
+
+        if not undated_df.empty:
+            undated_df.sort_values(
+                by=["block_number"], ascending=False, kind="stable"
+            ).reindex(columns=output_columns).to_csv(
+                output_file, header=header, index=False
+            )